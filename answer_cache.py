@@ -0,0 +1,147 @@
+"""
+In-memory cache of /ask answers.
+
+Entries are keyed by user, normalized question, the retrieved chunks (vector
+ids change whenever a text is re-indexed, so they double as versions) and the
+prompt/temperature/model. A question that misses the exact key can still hit
+an earlier answer of the same user whose question embedding is within
+ANSWER_CACHE_SIMILARITY, as long as the user's index hasn't changed since.
+Entries expire after ANSWER_CACHE_TTL seconds, are evicted least recently
+used past ANSWER_CACHE_SIZE, and are dropped when a text or document they
+were built from changes.
+"""
+
+import os
+import re
+import time
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set
+from embeded_store import get_embedding
+
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "2000"))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))  # 0 disables semantic matching
+
+
+def normalize_question(question: str) -> str:
+    return " ".join(re.findall(r"\w+", question.lower()))
+
+
+class AnswerCache:
+    def __init__(self, max_entries: int = ANSWER_CACHE_SIZE, ttl: int = ANSWER_CACHE_TTL,
+                 similarity: float = ANSWER_CACHE_SIMILARITY):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self._entries: "OrderedDict[tuple, dict]" = OrderedDict()
+        self._by_user: Dict[int, Set[tuple]] = {}
+        self._by_text: Dict[int, Set[tuple]] = {}
+        self._by_document: Dict[int, Set[tuple]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    def make_key(self, user_id: int, question: str, chunks: List[dict], settings_key: tuple) -> tuple:
+        chunk_key = tuple(sorted((c["text_id"], c["id"]) for c in chunks))
+        return (user_id, normalize_question(question), chunk_key, settings_key)
+
+    def _drop(self, key: tuple):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._by_user.get(key[0], set()).discard(key)
+        for text_id in entry["text_ids"]:
+            self._by_text.get(text_id, set()).discard(key)
+        for document_id in entry["document_ids"]:
+            self._by_document.get(document_id, set()).discard(key)
+
+    def _expired(self, entry: dict) -> bool:
+        return time.monotonic() - entry["created_at"] > self.ttl
+
+    def get(self, key: tuple, question: str, generation: int) -> Optional[dict]:
+        """
+        Return {"answer", "chunks"} for an exact or semantically similar cached question.
+        generation is the user's current index generation (see VectorStore.generation).
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not self._expired(entry):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            if entry is not None:
+                self._drop(key)
+            candidates = [
+                k for k in self._by_user.get(key[0], ())
+                if k[3] == key[3] and self._entries[k]["generation"] == generation
+            ]
+        if self.similarity and candidates:
+            vector = self._embed(question)
+            with self._lock:
+                best_key, best_score = None, self.similarity
+                for k in candidates:
+                    candidate = self._entries.get(k)
+                    if candidate is None or self._expired(candidate):
+                        continue
+                    score = float(np.dot(vector, candidate["vector"]))
+                    if score >= best_score:
+                        best_key, best_score = k, score
+                if best_key is not None:
+                    self._entries.move_to_end(best_key)
+                    self.semantic_hits += 1
+                    return self._entries[best_key]
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: tuple, question: str, answer: str, chunks: List[dict], generation: int):
+        vector = self._embed(question) if self.similarity else None
+        entry = {
+            "answer": answer,
+            "chunks": chunks,
+            "vector": vector,
+            "generation": generation,
+            "text_ids": {c["text_id"] for c in chunks},
+            "document_ids": {c["document_id"] for c in chunks},
+            "created_at": time.monotonic(),
+        }
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = entry
+            self._by_user.setdefault(key[0], set()).add(key)
+            for text_id in entry["text_ids"]:
+                self._by_text.setdefault(text_id, set()).add(key)
+            for document_id in entry["document_ids"]:
+                self._by_document.setdefault(document_id, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate_text(self, text_id: int):
+        with self._lock:
+            for key in list(self._by_text.pop(text_id, ())):
+                self._drop(key)
+
+    def invalidate_document(self, document_id: int):
+        with self._lock:
+            for key in list(self._by_document.pop(document_id, ())):
+                self._drop(key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+            }
+
+    @staticmethod
+    def _embed(question: str) -> np.ndarray:
+        vector = np.asarray(get_embedding(question), dtype="float32")
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+
+answer_cache = AnswerCache()
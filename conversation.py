@@ -0,0 +1,118 @@
+"""
+Multi-turn conversation memory for /ask.
+
+A ConversationSession keeps a rolling summary of its older turns and the
+vector ids of the chunks the last turn was answered from. A follow-up
+question is sent with the summary, the most recent turns and the earlier
+turns most relevant to it (BM25 over the session's Q&A), and can reuse the
+previous turn's chunks instead of depending on a fresh retrieval.
+"""
+
+import os
+from datetime import datetime
+from typing import List, Optional
+from sqlalchemy import select
+from sqlalchemy.orm import undefer
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import AsyncSessionLocal, ConversationSession, Question
+from embeded_store import BM25Index, VectorStore
+from llm_client import llm
+
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", "50"))         # past turns searched per question
+SESSION_RECENT_TURNS = int(os.getenv("SESSION_RECENT_TURNS", "2"))    # always sent verbatim
+SESSION_RELEVANT_TURNS = int(os.getenv("SESSION_RELEVANT_TURNS", "2"))  # older turns picked by relevance
+SESSION_SUMMARY_EVERY = int(os.getenv("SESSION_SUMMARY_EVERY", "4"))  # refresh the summary after this many new turns
+SUMMARY_TOKENS = 250
+
+async def get_session(db: AsyncSession, user_id: int, session_id: int) -> Optional[ConversationSession]:
+    return await db.scalar(select(ConversationSession).where(
+        ConversationSession.id == session_id, ConversationSession.user_id == user_id
+    ))
+
+async def load_turns(db: AsyncSession, user_id: int, session_id: int, limit: int = SESSION_MAX_TURNS) -> List[Question]:
+    """
+    The session's latest turns, oldest first (served by ix_questions_user_session_created).
+    """
+    turns = (await db.scalars(
+        select(Question)
+        .options(undefer(Question.answer_text))  # deferred by default; async sessions can't lazy-load it
+        .where(Question.user_id == user_id, Question.session_id == session_id)
+        .order_by(Question.created_at.desc(), Question.id.desc())
+        .limit(limit)
+    )).all()
+    return turns[::-1]
+
+def select_turns(turns: List[Question], question: str) -> List[Question]:
+    """
+    The most recent turns plus the older turns that best match the question, in order.
+    """
+    recent = turns[-SESSION_RECENT_TURNS:] if SESSION_RECENT_TURNS else []
+    older = turns[:len(turns) - len(recent)]
+    picked = []
+    if older and SESSION_RELEVANT_TURNS:
+        index = BM25Index()
+        for i, turn in enumerate(older):
+            index.add(i, f"{turn.question_text} {turn.answer_text or ''}")
+        picked = sorted(i for i, _ in index.search(question, SESSION_RELEVANT_TURNS))
+    return [older[i] for i in picked] + recent
+
+def history_messages(session: ConversationSession, turns: List[Question]) -> List[dict]:
+    messages = []
+    if session.summary:
+        messages.append({"role": "system", "content": f"Summary of the conversation so far:\n{session.summary}"})
+    for turn in turns:
+        messages.append({"role": "user", "content": turn.question_text})
+        messages.append({"role": "assistant", "content": turn.answer_text or ""})
+    return messages
+
+def previous_chunks(session: ConversationSession, store: VectorStore) -> List[dict]:
+    """
+    Chunks the last turn was answered from that are still in the index.
+    """
+    chunks = []
+    for vid in (int(i) for i in (session.context_chunk_ids or "").split(",") if i):
+        chunk = store.chunks.get(vid)
+        if chunk is not None:
+            chunks.append(dict(chunk, id=vid, score=0.0, reused=True))
+    return chunks
+
+async def record_turn(db: AsyncSession, session_id: int, question: str, used_chunks: List[dict]):
+    """
+    Remember the chunks of the turn just answered (committed with the Q&A).
+    """
+    session = await db.get(ConversationSession, session_id)
+    if session is None:
+        return
+    session.context_chunk_ids = ",".join(str(c["id"]) for c in used_chunks if "id" in c)
+    session.turn_count = (session.turn_count or 0) + 1
+    session.updated_at = datetime.utcnow()
+    if not session.title:
+        session.title = question[:80]
+
+async def refresh_summary(session_id: int):
+    """
+    Fold the turns added since the last summary into the rolling summary, once
+    SESSION_SUMMARY_EVERY new turns have accumulated. Run after the response is sent.
+    """
+    async with AsyncSessionLocal() as db:
+        session = await db.get(ConversationSession, session_id)
+        new_turns = (session.turn_count or 0) - (session.summarized_turns or 0) if session else 0
+        if new_turns < SESSION_SUMMARY_EVERY:
+            return
+        turn_count = session.turn_count
+        turns = await load_turns(db, session.user_id, session_id, limit=new_turns)
+        transcript = "\n".join(f"Q: {t.question_text}\nA: {t.answer_text or ''}" for t in turns)
+        messages = [
+            {"role": "system", "content": "Update the conversation summary with the new turns. "
+                                          "Keep names, facts and open questions; stay under 150 words."},
+            {"role": "user", "content": f"Current summary:\n{session.summary or '(none)'}\n\nNew turns:\n{transcript}"},
+        ]
+        await db.commit()  # don't hold a connection while the model runs
+
+        try:
+            summary = await llm.complete(messages, temperature=0.2, max_tokens=SUMMARY_TOKENS)
+        except Exception:
+            return  # keep the old summary; it is retried after the next turn
+        session.summary = summary
+        session.summarized_turns = turn_count
+        await db.commit()
@@ -1,53 +1,736 @@
 import os
+import re
+import json
+import math
+import heapq
+import hashlib
+import sqlite3
+import time
+import queue
+import threading
+import weakref
 import faiss
 import numpy as np
-from typing import List
+from collections import Counter, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
 from sentence_transformers import SentenceTransformer
 
 # Load local embedding model
 embedding_model = SentenceTransformer("all-MiniLM-L6-v2")  # 384-dim embeddings
+EMBEDDING_DIM = 384
+
+# Per-user indexes live under this folder as index.faiss + ids.json, plus a
+# journal.jsonl of the changes made since that snapshot was written
+INDEX_FOLDER = os.getenv("VECTOR_INDEX_DIR", "vector_indexes")
+# How many user indexes are kept in memory at once (least recently used are dropped)
+MAX_LOADED_STORES = int(os.getenv("VECTOR_MAX_LOADED_USERS", "32"))
+# Fold the journal into a new snapshot once it holds this share of the index's chunks
+JOURNAL_COMPACT_RATIO = float(os.getenv("VECTOR_JOURNAL_COMPACT_RATIO", "0.5"))
+
+# Index backend: flat (exact), ivf_flat, ivf_pq or hnsw
+INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "flat").lower()
+# Distance: l2, ip (inner product) or cosine (normalized inner product)
+INDEX_METRIC = os.getenv("VECTOR_METRIC", "l2").lower()
+# IVF indexes start out flat and are trained once this many vectors exist
+IVF_TRAIN_MIN = int(os.getenv("VECTOR_TRAIN_MIN", "10000"))
+IVF_NLIST = int(os.getenv("VECTOR_NLIST", "0"))  # 0 = pick from corpus size at training time
+IVF_NPROBE = int(os.getenv("VECTOR_NPROBE", "16"))
+PQ_M = int(os.getenv("VECTOR_PQ_M", "48"))  # sub-quantizers, must divide EMBEDDING_DIM (48 -> 48 bytes/vector)
+PQ_NBITS = int(os.getenv("VECTOR_PQ_NBITS", "8"))
+HNSW_M = int(os.getenv("VECTOR_HNSW_M", "32"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("VECTOR_EF_CONSTRUCTION", "200"))
+HNSW_EF_SEARCH = int(os.getenv("VECTOR_EF_SEARCH", "64"))
+# Rebuild an index that cannot delete in place (HNSW) once this share of it is dead vectors
+TOMBSTONE_REBUILD_RATIO = 0.2
+
+# Embedding pipeline: chunks per encode call, concurrent encode calls, and how
+# long to wait for more chunks from other uploads before encoding a partial batch
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "2"))
+EMBED_MAX_WAIT_MS = int(os.getenv("EMBED_MAX_WAIT_MS", "10"))
+# Chunk embeddings keyed by SHA-256 of the chunk text, shared by all users and processes
+EMBEDDING_CACHE_FILE = os.getenv("EMBEDDING_CACHE_FILE", "embedding_cache.db")
+
+def _faiss_metric(metric: str):
+    return faiss.METRIC_L2 if metric == "l2" else faiss.METRIC_INNER_PRODUCT
+
+def build_index(index_type: str, metric: str, train_vectors: np.ndarray = None) -> faiss.Index:
+    """
+    Create an empty index that takes external ids. IVF types need train_vectors;
+    without them a flat index is returned that can be upgraded later.
+
+    IVF indexes are returned bare: they store ids in their inverted lists and
+    support add_with_ids/remove_ids natively. Wrapping them in IndexIDMap2 breaks
+    on removal, since IndexIVF.remove_ids doesn't renumber the wrapper's ids.
+    """
+    faiss_metric = _faiss_metric(metric)
+    if index_type in ("ivf_flat", "ivf_pq") and train_vectors is not None:
+        n = len(train_vectors)
+        nlist = IVF_NLIST or max(1, min(int(4 * np.sqrt(n)), n // 39))
+        quantizer = faiss.IndexFlatL2(EMBEDDING_DIM) if metric == "l2" else faiss.IndexFlatIP(EMBEDDING_DIM)
+        if index_type == "ivf_pq":
+            base = faiss.IndexIVFPQ(quantizer, EMBEDDING_DIM, nlist, PQ_M, PQ_NBITS, faiss_metric)
+        else:
+            base = faiss.IndexIVFFlat(quantizer, EMBEDDING_DIM, nlist, faiss_metric)
+        base.train(train_vectors)
+        base.nprobe = IVF_NPROBE
+        return base
+    elif index_type == "hnsw":
+        base = faiss.IndexHNSWFlat(EMBEDDING_DIM, HNSW_M, faiss_metric)
+        base.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        base.hnsw.efSearch = HNSW_EF_SEARCH
+    else:
+        base = faiss.IndexFlat(EMBEDDING_DIM, faiss_metric)
+    return faiss.IndexIDMap2(base)
 
 def get_embedding(text: str) -> np.ndarray:
     return embedding_model.encode(text)
 
+
+# -------------------- BATCHED EMBEDDING --------------------
+class EmbeddingPipeline:
+    """
+    Collects chunks from all concurrent callers into batches of up to batch_size
+    and encodes them on a bounded pool of workers.
+    """
+
+    def __init__(self, batch_size: int = EMBED_BATCH_SIZE, workers: int = EMBED_WORKERS, max_wait_ms: int = EMBED_MAX_WAIT_MS):
+        self.batch_size = batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: "queue.Queue[Tuple[str, Future]]" = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="embed")
+        self._slots = threading.BoundedSemaphore(workers)
+        self._dispatcher = None
+        self._start_lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self.chunks = 0
+        self.batches = 0
+        self.encode_seconds = 0.0
+
+    def _ensure_started(self):
+        if self._dispatcher is None:
+            with self._start_lock:
+                if self._dispatcher is None:
+                    self._dispatcher = threading.Thread(target=self._dispatch, name="embed-dispatch", daemon=True)
+                    self._dispatcher.start()
+
+    def _dispatch(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._slots.acquire()  # at most `workers` batches in flight
+            self._executor.submit(self._encode_batch, batch)
+
+    def _encode_batch(self, batch: List[Tuple[str, Future]]):
+        try:
+            start = time.perf_counter()
+            vectors = embedding_model.encode([text for text, _ in batch], batch_size=len(batch), convert_to_numpy=True)
+            elapsed = time.perf_counter() - start
+            with self._metrics_lock:
+                self.chunks += len(batch)
+                self.batches += 1
+                self.encode_seconds += elapsed
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self._slots.release()
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """
+        Encode texts (possibly batched together with other callers). Returns a float32 matrix.
+        """
+        if not texts:
+            return np.zeros((0, EMBEDDING_DIM), dtype="float32")
+        self._ensure_started()
+        futures = []
+        for text in texts:
+            future = Future()
+            self._queue.put((text, future))
+            futures.append(future)
+        return np.vstack([f.result() for f in futures]).astype("float32")
+
+    def stats(self) -> dict:
+        with self._metrics_lock:
+            return {
+                "chunks": self.chunks,
+                "batches": self.batches,
+                "avg_batch_size": round(self.chunks / self.batches, 2) if self.batches else 0,
+                "encode_seconds": round(self.encode_seconds, 3),
+                "chunks_per_second": round(self.chunks / self.encode_seconds, 1) if self.encode_seconds else 0,
+                "queued": self._queue.qsize(),
+            }
+
+embedding_pipeline = EmbeddingPipeline()
+
+
+# -------------------- EMBEDDING CACHE --------------------
+class EmbeddingCache:
+    """
+    SQLite table of chunk embeddings keyed by the SHA-256 of the chunk text, so
+    re-uploaded or shared content is never encoded twice.
+    """
+
+    def __init__(self, path: str = EMBEDDING_CACHE_FILE):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS embeddings (hash TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """
+        Return embeddings for texts, encoding only the ones not cached yet.
+        """
+        if not texts:
+            return np.zeros((0, EMBEDDING_DIM), dtype="float32")
+        keys = [hashlib.sha256(t.encode("utf-8")).hexdigest() for t in texts]
+        conn = self._connect()
+        found = {}
+        unique = list(set(keys))
+        for i in range(0, len(unique), 500):  # stay under SQLite's variable limit
+            batch = unique[i:i + 500]
+            rows = conn.execute(
+                f"SELECT hash, vector FROM embeddings WHERE hash IN ({','.join('?' * len(batch))})", batch
+            ).fetchall()
+            found.update({h: np.frombuffer(v, dtype="float32") for h, v in rows})
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        if missing:
+            vectors = embedding_pipeline.encode(list(missing.values()))
+            new = dict(zip(missing.keys(), vectors))
+            with conn:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO embeddings (hash, vector) VALUES (?, ?)",
+                    [(h, v.astype("float32").tobytes()) for h, v in new.items()],
+                )
+            found.update(new)
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+        return np.vstack([found[k] for k in keys]).astype("float32")
+
+    def stats(self) -> dict:
+        return {"cache_hits": self.hits, "cache_misses": self.misses}
+
+embedding_cache = EmbeddingCache()
+
 def split_text(text: str, max_tokens: int = 300) -> List[str]:
-    # Naive split — keep it simple for now
+    # Naive split on lines; lines longer than max_tokens (cleaned text has no
+    # newlines at all) are cut into word windows so no chunk exceeds the limit.
     lines = text.split("\n")
     chunks = []
     current = []
     current_len = 0
     for line in lines:
-        tokens = len(line.split())
+        words = line.split()
+        while len(words) > max_tokens:
+            if current:
+                chunks.append(" ".join(current))
+                current = []
+                current_len = 0
+            chunks.append(" ".join(words[:max_tokens]))
+            words = words[max_tokens:]
+        tokens = len(words)
+        if not tokens:
+            continue
         if current_len + tokens > max_tokens:
             chunks.append(" ".join(current))
             current = []
             current_len = 0
-        current.append(line)
+        current.append(" ".join(words))
         current_len += tokens
     if current:
         chunks.append(" ".join(current))
     return chunks
 
+# -------------------- LEXICAL (BM25) INDEX --------------------
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "how", "in", "is", "it", "of",
+    "on", "or", "that", "the", "this", "to", "was", "what", "when", "where", "which", "who", "why", "with",
+}
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in re.findall(r"\w+", text.lower()) if t not in STOPWORDS]
+
+class BM25Index:
+    """
+    In-memory Okapi BM25 over chunks, keyed by the same ids as the vector index.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[int, int]] = {}  # term -> {chunk id: term frequency}
+        self.lengths: Dict[int, int] = {}
+        self.total_length = 0
+
+    def add(self, chunk_id: int, text: str):
+        terms = tokenize(text)
+        for term, tf in Counter(terms).items():
+            self.postings.setdefault(term, {})[chunk_id] = tf
+        self.lengths[chunk_id] = len(terms)
+        self.total_length += len(terms)
+
+    def remove(self, chunk_id: int, text: str):
+        if chunk_id not in self.lengths:
+            return
+        for term in set(tokenize(text)):
+            posting = self.postings.get(term)
+            if posting is not None:
+                posting.pop(chunk_id, None)
+                if not posting:
+                    del self.postings[term]
+        self.total_length -= self.lengths.pop(chunk_id)
+
+    def search(self, query: str, top_k: int = 5) -> List[Tuple[int, float]]:
+        n = len(self.lengths)
+        if not n:
+            return []
+        avg_length = self.total_length / n or 1.0
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+            for chunk_id, tf in posting.items():
+                norm = tf + self.k1 * (1 - self.b + self.b * self.lengths[chunk_id] / avg_length)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (self.k1 + 1) / norm
+        return heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+
+
 class VectorStore:
-    def __init__(self):
-        self.text_chunks: List[str] = []
-        self.index = faiss.IndexFlatL2(384)  # Because MiniLM embedding size is 384
+    """
+    FAISS index of text chunks keyed by vector id, with an id map back to the
+    ExtractedText row (and its version) each chunk came from. When a folder is
+    given the index is persisted there and only read from disk on first use.
+
+    Changes are appended to a journal rather than rewriting the whole index on
+    every save; the snapshot is only rewritten once the journal has grown to
+    JOURNAL_COMPACT_RATIO of the index (or after the index was rebuilt).
+
+    Chunk texts (and their BM25 postings) are kept in memory and in ids.json,
+    so IVF-PQ only shrinks the vectors: for 384-dim embeddings the text and
+    postings, not the vectors, dominate a store's memory.
+    """
+
+    def __init__(self, folder: Optional[str] = None, index_type: str = INDEX_TYPE, metric: str = INDEX_METRIC):
+        self.folder = folder
+        self.index_type = index_type
+        self.metric = metric
+        self.trained = False  # whether an IVF index has replaced the initial flat one
+        self.index = build_index(index_type, metric)
+        self.chunks: Dict[int, dict] = {}          # vector id -> {text_id, document_id, text}
+        self.texts: Dict[int, dict] = {}           # text_id -> {version, document_id, ids}
+        self.next_id = 0
+        self.tombstones = 0  # vectors still in an index that can't remove them
+        self.lexical = BM25Index()  # rebuilt from the id map on load, not persisted
+        self.generation = 0  # bumped on every change, so callers can tell if results may be stale
+        self.loaded = False
+        self._journal: List[dict] = []  # changes not saved yet
+        self.journal_chunks = 0  # chunks in the journal on disk
+        self._snapshot_stale = False  # index rebuilt since the last snapshot
+        self._rebuilding = False
+        self._lock = threading.Lock()
+        self._lexical_lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    @property
+    def index_path(self) -> Optional[str]:
+        return os.path.join(self.folder, "index.faiss") if self.folder else None
+
+    @property
+    def ids_path(self) -> Optional[str]:
+        return os.path.join(self.folder, "ids.json") if self.folder else None
+
+    @property
+    def journal_path(self) -> Optional[str]:
+        return os.path.join(self.folder, "journal.jsonl") if self.folder else None
 
     def embed(self, text: str) -> np.ndarray:
-        return get_embedding(text).astype("float32")
-
-    def chunk_text(self, text: str, chunk_size: int = 500) -> List[str]:
-        tokens = text.split()
-        return [' '.join(tokens[i:i + chunk_size]) for i in range(0, len(tokens), chunk_size)]
-
-    def add_documents(self, text: str):
-        chunks = self.chunk_text(text)
-        for chunk in chunks:
-            embedding = self.embed(chunk)
-            self.index.add(np.array([embedding]))
-            self.text_chunks.append(chunk)
-
-    def search(self, query: str, top_k: int = 5) -> List[str]:
-        embedding = self.embed(query)
-        D, I = self.index.search(np.array([embedding]), top_k)
-        return [self.text_chunks[i] for i in I[0] if i < len(self.text_chunks)]
+        vector = get_embedding(text).astype("float32")
+        if self.metric == "cosine":
+            vector = vector / (np.linalg.norm(vector) or 1.0)
+        return vector
+
+    def embed_many(self, texts: List[str]) -> np.ndarray:
+        vectors = embedding_cache.encode(texts)
+        if self.metric == "cosine" and len(vectors):
+            faiss.normalize_L2(vectors)
+        return vectors
+
+    def chunk_text(self, text: str, chunk_size: int = 300) -> List[str]:
+        return split_text(text, max_tokens=chunk_size)
+
+    # ---------- persistence ----------
+    def _read(self) -> bool:
+        with open(self.ids_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        # An index built with another backend or metric is rebuilt instead of reused
+        if data.get("index_type", "flat") != self.index_type or data.get("metric", "l2") != self.metric:
+            return False
+        self.index = faiss.read_index(self.index_path)
+        self.trained = data.get("trained", False)
+        self.tombstones = data.get("tombstones", 0)
+        self.next_id = data["next_id"]
+        self.chunks = {int(k): v for k, v in data["chunks"].items()}
+        self.texts = {int(k): v for k, v in data["texts"].items()}
+        for vid, chunk in self.chunks.items():
+            self.lexical.add(vid, chunk["text"])
+        if self.trained and isinstance(self.index, faiss.IndexIDMap):
+            self._rebuild(train=True)  # saved by an older version with the IVF index id-mapped
+        self._replay()
+        return True
+
+    def _replay(self):
+        """
+        Re-apply the journal on top of the snapshot. Entries are idempotent, so
+        entries already folded into the snapshot (a crash during compaction) and a
+        torn last line (a crash while appending) are both harmless.
+        """
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                if entry["op"] == "upsert":
+                    embeddings = self.embed_many(entry["chunks"])
+                    self._insert(entry["text_id"], entry["document_id"], entry["version"], entry["chunks"], entry["ids"])
+                    if entry["ids"]:
+                        self.index.add_with_ids(embeddings, np.array(entry["ids"], dtype="int64"))
+                    self.journal_chunks += len(entry["ids"])
+                else:
+                    for text_id in entry["text_ids"]:
+                        existing = self.texts.pop(text_id, None)
+                        if existing is not None:
+                            self._remove_ids(existing["ids"])
+                    self.journal_chunks += len(entry["text_ids"])
+                self._maybe_train()
+
+    def save(self):
+        """
+        Persist the changes made since the last save: appended to the journal, or
+        written as a new snapshot when the journal has grown too large.
+        """
+        if not self.folder:
+            return
+        os.makedirs(self.folder, exist_ok=True)
+        with self._lock:
+            entries, self._journal = self._journal, []
+            chunks = sum(len(e["ids"]) if e["op"] == "upsert" else len(e["text_ids"]) for e in entries)
+            compact = (
+                self._snapshot_stale
+                or not os.path.exists(self.index_path)
+                or self.journal_chunks + chunks > JOURNAL_COMPACT_RATIO * len(self.chunks)
+            )
+            if not compact:
+                with open(self.journal_path, "a", encoding="utf-8") as f:
+                    for entry in entries:
+                        f.write(json.dumps(entry) + "\n")
+                self.journal_chunks += chunks
+                return
+            faiss.write_index(self.index, self.index_path + ".tmp")
+            data = {
+                "index_type": self.index_type,
+                "metric": self.metric,
+                "trained": self.trained,
+                "tombstones": self.tombstones,
+                "next_id": self.next_id,
+                "chunks": self.chunks,
+                "texts": self.texts,
+            }
+            with open(self.ids_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(self.index_path + ".tmp", self.index_path)
+            os.replace(self.ids_path + ".tmp", self.ids_path)
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+            self.journal_chunks = 0
+            self._snapshot_stale = False
+
+    def ensure_loaded(self, loader: Callable[[], Iterable[Tuple[int, int, str, int]]] = None) -> bool:
+        """
+        Load the index from disk, or build it once from (text_id, document_id, content, version)
+        rows returned by loader. Returns False if there is nothing on disk and no loader was given.
+        """
+        if self.loaded:
+            return True
+        with self._load_lock:
+            if self.loaded:
+                return True
+            on_disk = self.index_path and os.path.exists(self.index_path) and os.path.exists(self.ids_path)
+            if on_disk and self._read():
+                pass
+            elif loader is not None:
+                self._upsert_many(list(loader()))
+                self._snapshot_stale = True
+                self.save()
+            else:
+                return False
+            self.loaded = True
+            return True
+
+    # ---------- mutation ----------
+    def _build_from(self, texts: Dict[int, str], train: bool) -> faiss.Index:
+        """
+        A new index of the given {vector id: chunk text}, trained if asked. Vectors are
+        re-encoded from the texts (served by the embedding cache) rather than
+        reconstructed: IVF-PQ vectors are lossy and an IVF index has no contiguous
+        positions to reconstruct from.
+        """
+        ids = np.array(sorted(texts), dtype="int64")
+        vectors = self.embed_many([texts[int(i)] for i in ids])
+        index = build_index(self.index_type, self.metric, vectors if train else None)
+        if len(ids):
+            index.add_with_ids(vectors, ids)
+        return index
+
+    def _rebuild_due(self) -> Optional[bool]:
+        """
+        None if the index is fine as is, else whether its rebuild should train an IVF index.
+        """
+        if self.index_type in ("ivf_flat", "ivf_pq") and not self.trained and self.index.ntotal >= IVF_TRAIN_MIN:
+            return True
+        if self.tombstones and self.tombstones > TOMBSTONE_REBUILD_RATIO * self.index.ntotal:
+            return self.trained
+        return None
+
+    def _rebuild(self, train: bool):
+        """
+        Re-create the index from its live chunks in place (while loading, before anyone searches it).
+        """
+        self.index = self._build_from({vid: c["text"] for vid, c in self.chunks.items()}, train)
+        self.trained = train
+        self.tombstones = 0
+        self._snapshot_stale = True
+
+    def _maybe_train(self):
+        train = self._rebuild_due()
+        if train is not None:
+            self._rebuild(train)
+
+    def _rebuild_if_due(self):
+        """
+        Rebuild (or train) the index if it is due. The new index is encoded and
+        trained outside the lock, so searches keep using the old one meanwhile;
+        chunks added or removed in the meantime are applied to it before the swap.
+        """
+        with self._lock:
+            train = self._rebuild_due()
+            if train is None or self._rebuilding:
+                return
+            self._rebuilding = True
+            texts = {vid: c["text"] for vid, c in self.chunks.items()}
+        try:
+            index = self._build_from(texts, train)
+            with self._lock:
+                removed = [vid for vid in texts if vid not in self.chunks]
+                added = [vid for vid in self.chunks if vid not in texts]
+                tombstones = 0
+                if removed:
+                    try:
+                        index.remove_ids(np.array(removed, dtype="int64"))
+                    except RuntimeError:
+                        tombstones = len(removed)  # HNSW
+                if added:
+                    index.add_with_ids(self.embed_many([self.chunks[vid]["text"] for vid in added]),
+                                       np.array(added, dtype="int64"))
+                self.index, self.trained, self.tombstones = index, train, tombstones
+                self._snapshot_stale = True
+                self.generation += 1
+        finally:
+            self._rebuilding = False
+
+    def _remove_ids(self, ids: List[int]):
+        if ids:
+            try:
+                self.index.remove_ids(np.array(ids, dtype="int64"))
+            except RuntimeError:
+                # HNSW can't delete: drop the ids from the map so search skips them
+                self.tombstones += len(ids)
+        with self._lexical_lock:
+            for vid in ids:
+                chunk = self.chunks.pop(vid, None)
+                if chunk is not None:
+                    self.lexical.remove(vid, chunk["text"])
+
+    def _insert(self, text_id: int, document_id: int, version: int, chunks: List[str], ids: List[int]):
+        """
+        Point a text at new chunk ids, dropping its old ones. The vectors are added by the caller.
+        """
+        existing = self.texts.get(text_id)
+        if existing is not None:
+            self._remove_ids(existing["ids"])
+        with self._lexical_lock:
+            for vid, chunk in zip(ids, chunks):
+                self.chunks[vid] = {"text_id": text_id, "document_id": document_id, "text": chunk}
+                self.lexical.add(vid, chunk)
+        self.texts[text_id] = {"version": version, "document_id": document_id, "ids": ids}
+        if ids:
+            self.next_id = max(self.next_id, ids[-1] + 1)
+
+    def _upsert_many(self, rows: List[Tuple[int, int, str, int]]) -> bool:
+        """
+        Add or replace (text_id, document_id, content, version) rows, encoding the
+        chunks of all of them together and adding the vectors in one call.
+        """
+        pending = []
+        for text_id, document_id, content, version in rows:
+            existing = self.texts.get(text_id)
+            if existing is not None and existing["version"] == version:
+                continue
+            pending.append((text_id, document_id, version, self.chunk_text(content or "")))
+        if not pending:
+            return False
+        all_chunks = [chunk for _, _, _, chunks in pending for chunk in chunks]
+        embeddings = self.embed_many(all_chunks)
+        with self._lock:
+            ids = []
+            for text_id, document_id, version, chunks in pending:
+                text_ids = list(range(self.next_id, self.next_id + len(chunks)))
+                self._insert(text_id, document_id, version, chunks, text_ids)
+                self._journal.append({"op": "upsert", "text_id": text_id, "document_id": document_id,
+                                      "version": version, "ids": text_ids, "chunks": chunks})
+                ids.extend(text_ids)
+            if ids:
+                self.index.add_with_ids(embeddings, np.array(ids, dtype="int64"))
+            self.generation += 1
+        self._rebuild_if_due()
+        return True
+
+    def add_documents(self, text: str, text_id: int, document_id: int, version: int = None):
+        """
+        Add or replace the chunks of one ExtractedText row. Unchanged versions are skipped.
+        """
+        if self._upsert_many([(text_id, document_id, text, version)]):
+            self.save()
+
+    def add_many(self, rows: List[Tuple[int, int, str, int]]):
+        """
+        Add or replace several (text_id, document_id, content, version) rows at once.
+        """
+        if self._upsert_many(rows):
+            self.save()
+
+    def remove_text(self, text_id: int):
+        with self._lock:
+            entry = self.texts.pop(text_id, None)
+            if entry is None:
+                return
+            self._remove_ids(entry["ids"])
+            self._journal.append({"op": "remove", "text_ids": [text_id]})
+            self.generation += 1
+        self._rebuild_if_due()
+        self.save()
+
+    def remove_document(self, document_id: int):
+        with self._lock:
+            text_ids = [tid for tid, t in self.texts.items() if t["document_id"] == document_id]
+            if not text_ids:
+                return
+            for tid in text_ids:
+                self._remove_ids(self.texts.pop(tid)["ids"])
+            self._journal.append({"op": "remove", "text_ids": text_ids})
+            self.generation += 1
+        self._rebuild_if_due()
+        self.save()
+
+    # ---------- query ----------
+    def _set_search_params(self, nprobe: int = None, ef_search: int = None):
+        if self.trained:
+            faiss.extract_index_ivf(self.index).nprobe = nprobe or IVF_NPROBE
+        elif self.index_type == "hnsw":
+            faiss.downcast_index(self.index.index).hnsw.efSearch = ef_search or HNSW_EF_SEARCH
+
+    def search(self, query: str, top_k: int = 5, nprobe: int = None, ef_search: int = None) -> List[dict]:
+        """
+        Return the top_k closest chunks as dicts with text, text_id, document_id and score
+        (higher is better). nprobe / ef_search override the IVF / HNSW defaults.
+        """
+        return self.search_many([query], top_k, nprobe, ef_search)[0]
+
+    def search_many(self, queries: List[str], top_k: int = 5, nprobe: int = None,
+                    ef_search: int = None) -> List[List[dict]]:
+        """
+        search() for several queries with one batched embedding call and one index search.
+        """
+        if self.index.ntotal == 0 or not queries:
+            return [[] for _ in queries]
+        embeddings = np.asarray(embedding_model.encode(queries), dtype="float32")
+        if self.metric == "cosine":
+            faiss.normalize_L2(embeddings)
+        with self._lock:
+            self._set_search_params(nprobe, ef_search)
+            k = min(top_k + self.tombstones, self.index.ntotal)
+            D, I = self.index.search(embeddings, k)
+            all_results = []
+            for dists, vids in zip(D, I):
+                results = []
+                for dist, vid in zip(dists, vids):
+                    chunk = self.chunks.get(int(vid))
+                    if chunk is None:
+                        continue
+                    score = 1.0 / (1.0 + dist) if self.metric == "l2" else dist
+                    results.append(dict(chunk, id=int(vid), score=float(score)))
+                all_results.append(results[:top_k])
+        return all_results
+
+    def lexical_search(self, query: str, top_k: int = 5) -> List[dict]:
+        """
+        BM25 keyword search over the same chunks; same result format as search().
+        """
+        with self._lexical_lock:
+            hits = self.lexical.search(query, top_k)
+            return [dict(self.chunks[vid], id=vid, score=score) for vid, score in hits if vid in self.chunks]
+
+
+# -------------------- PER-USER STORES --------------------
+_user_stores: "OrderedDict[int, VectorStore]" = OrderedDict()
+# Every store still referenced somewhere (an ingest job, a request), including
+# ones the LRU has dropped, so a user never gets two instances writing one folder
+_live_stores: "weakref.WeakValueDictionary[int, VectorStore]" = weakref.WeakValueDictionary()
+_stores_lock = threading.Lock()
+
+def get_user_store(user_id: int) -> VectorStore:
+    """
+    Return the (not yet loaded) store for a user, keeping at most MAX_LOADED_STORES
+    in memory once they are no longer in use.
+    """
+    with _stores_lock:
+        store = _user_stores.get(user_id) or _live_stores.get(user_id)
+        if store is None:
+            store = VectorStore(os.path.join(INDEX_FOLDER, f"user_{user_id}"))
+            _live_stores[user_id] = store
+        if user_id not in _user_stores:
+            _user_stores[user_id] = store
+        _user_stores.move_to_end(user_id)
+        while len(_user_stores) > MAX_LOADED_STORES:
+            _user_stores.popitem(last=False)
+        return store
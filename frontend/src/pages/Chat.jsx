@@ -9,6 +9,7 @@ export default function Chat() {
   const [messages, setMessages] = useState([]);
   const [loading, setLoading] = useState(false);
   const [references, setReferences] = useState([]); // References / stories
+  const [sessionId, setSessionId] = useState(null); // Conversation the follow-up questions belong to
   const listRef = useRef(null);
   const token = localStorage.getItem("token");
 
@@ -38,33 +39,76 @@ export default function Chat() {
     setReferences([]); // Clear previous references
 
     try {
-      const res = await fetch(`${API_BASE}/ask`, {
+      // Start a conversation on the first question so follow-ups keep its context
+      let sid = sessionId;
+      if (!sid) {
+        const sres = await fetch(`${API_BASE}/sessions`, {
+          method: "POST",
+          headers: {
+            "Content-Type": "application/json",
+            Authorization: `Bearer ${token}`,
+          },
+          body: JSON.stringify({}),
+        });
+        if (sres.ok) {
+          sid = (await sres.json()).session_id;
+          setSessionId(sid);
+        }
+      }
+
+      const res = await fetch(`${API_BASE}/ask/stream`, {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
           Authorization: `Bearer ${token}`,
         },
-        body: JSON.stringify({ question: q }),
+        body: JSON.stringify({ question: q, session_id: sid }),
       });
 
-      const data = await res.json();
-
       if (!res.ok) {
+        const data = await res.json();
         throw new Error(data.detail || "Server error");
       }
 
-      const answer = data.answer || "No answer returned.";
-      const qid = data.question_id;
+      // Empty bot message that tokens are appended to as they stream in
+      setMessages((m) => [...m, { role: "bot", text: "" }]);
+      setLoading(false);
 
-      // Bot ka jawab aur "View Sources" button add karna
-      setMessages((m) => [
-        ...m,
-        {
-          role: "bot",
-          text: answer,
-          question_id: qid,
-        },
-      ]);
+      const updateLast = (fn) =>
+        setMessages((m) => [...m.slice(0, -1), fn(m[m.length - 1])]);
+
+      let answer = "";
+      let qid = null;
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+
+      // Server-Sent Events: blocks separated by a blank line, "event:" + "data:" lines
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split("\n\n");
+        buffer = events.pop();
+        for (const block of events) {
+          const event = (block.match(/^event: (.*)$/m) || [])[1];
+          const data = JSON.parse((block.match(/^data: (.*)$/m) || [])[1] || "{}");
+          if (event === "token") {
+            answer += data.token;
+            updateLast((msg) => ({ ...msg, text: answer }));
+          } else if (event === "done") {
+            qid = data.question_id;
+            updateLast((msg) => ({ ...msg, question_id: qid }));
+          } else if (event === "error") {
+            throw new Error(data.detail || "Model error");
+          }
+        }
+      }
+
+      if (!answer) {
+        answer = "No answer returned.";
+        updateLast((msg) => ({ ...msg, text: answer }));
+      }
 
       // Save QnA
       await fetch(`${API_BASE}/save`, {
@@ -136,6 +180,12 @@ export default function Chat() {
     }
   };
 
+  const newChat = () => {
+    setSessionId(null);
+    setMessages([]);
+    setReferences([]);
+  };
+
   const onKey = (e) => {
     if (e.key === "Enter" && !e.shiftKey) {
       e.preventDefault();
@@ -145,8 +195,11 @@ export default function Chat() {
 
   return (
     <div className="card">
-      <div className="card-header">
+      <div className="card-header flex items-center justify-between">
         <h2 className="card-title">Chat</h2>
+        <button onClick={newChat} className="text-sm text-blue-600 underline">
+          New chat
+        </button>
       </div>
       <div
         ref={listRef}
@@ -5,17 +5,20 @@ const API_BASE = import.meta.env.VITE_API_BASE || "http://127.0.0.1:8000";
 export default function Documents() {
   const [docs, setDocs] = useState([]);
   const [viewDoc, setViewDoc] = useState(null);
+  const [nextCursor, setNextCursor] = useState(null); // more pages if set
   const token = localStorage.getItem("token"); // <-- get user token
 
-  // Fetch all documents
-  async function loadDocs() {
+  // Fetch documents a page at a time
+  async function loadDocs(cursor = null) {
     try {
-      const res = await fetch(`${API_BASE}/documents`, {
+      const query = cursor ? `?cursor=${cursor}` : "";
+      const res = await fetch(`${API_BASE}/documents${query}`, {
         headers: { Authorization: `Bearer ${token}` } // ✅ FIXED
       });
       if (!res.ok) throw new Error("Failed to fetch documents");
       const data = await res.json();
-      setDocs(data);
+      setDocs((prev) => (cursor ? [...prev, ...data] : data));
+      setNextCursor(res.headers.get("X-Next-Cursor"));
     } catch (err) {
       console.error("Error fetching documents:", err);
     }
@@ -89,6 +92,11 @@ export default function Documents() {
           </li>
         ))}
       </ul>
+      {nextCursor && (
+        <button onClick={() => loadDocs(nextCursor)} className="text-sm text-blue-600 underline">
+          Load more
+        </button>
+      )}
 
       {/* Modal to show document content */}
       {viewDoc && (
@@ -6,16 +6,20 @@ const API_BASE = import.meta.env.VITE_API_BASE || "http://127.0.0.1:8000";
 export default function Save() {
   const [savedItems, setSavedItems] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [nextCursor, setNextCursor] = useState(null); // more pages if set
   const token = localStorage.getItem("token"); // ✅ get token
 
-  const fetchSaved = async () => {
+  const fetchSaved = async (cursor = null) => {
     try {
       const res = await axios.get(`${API_BASE}/saved`, {
-        headers: { Authorization: `Bearer ${token}` } // ✅ include token
+        headers: { Authorization: `Bearer ${token}` }, // ✅ include token
+        params: cursor ? { cursor } : {},
       });
       console.log("Saved API Response:", res.data);
 
-      setSavedItems(Array.isArray(res.data) ? res.data : []);
+      const page = Array.isArray(res.data) ? res.data : [];
+      setSavedItems((prev) => (cursor ? [...prev, ...page] : page));
+      setNextCursor(res.headers["x-next-cursor"] || null);
     } catch (err) {
       console.error("Error fetching saved items:", err);
       setSavedItems([]);
@@ -77,6 +81,11 @@ export default function Save() {
             </div>
           ))
         )}
+        {nextCursor && (
+          <button onClick={() => fetchSaved(nextCursor)} className="text-sm text-blue-600 underline">
+            Load more
+          </button>
+        )}
       </div>
     </div>
   );
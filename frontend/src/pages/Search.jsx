@@ -1,6 +1,13 @@
 import { useState } from "react";
 import axios from "axios";
 
+// Snippets wrap matches in <mark>…</mark>; render them as elements, not raw HTML
+function Highlighted({ text }) {
+  return text
+    .split(/<\/?mark>/)
+    .map((part, i) => (i % 2 === 1 ? <mark key={i}>{part}</mark> : <span key={i}>{part}</span>));
+}
+
 export default function SearchDocuments() {
   const [query, setQuery] = useState("");
   const [results, setResults] = useState([]);
@@ -73,7 +80,8 @@ export default function SearchDocuments() {
                 {new Date(doc.upload_date).toLocaleString()}
               </p>
               <p className="mt-2">
-                {doc.snippet ? doc.snippet : "No preview available"}...
+                {doc.page_number ? `Page ${doc.page_number}: ` : ""}
+                {doc.snippet ? <Highlighted text={doc.snippet} /> : "No preview available"}...
               </p>
             </li>
           ))}
@@ -0,0 +1,222 @@
+"""
+Document ingestion: background extraction jobs for uploaded files and the
+helpers that keep each user's vector index in sync with ExtractedText rows.
+
+Uploads only save the file and create a Document with status "pending".
+Text extraction (PyMuPDF / Tesseract) runs on a process pool, with large PDFs
+split into page ranges; each page becomes its own ExtractedText row. Writing
+the rows and embedding them runs on a small thread pool, so the request
+handlers never block the event loop. Jobs only live in this process: on start,
+documents a previous process left "pending" are queued again.
+"""
+
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+from sqlalchemy.orm import Session
+from models import SessionLocal, Document, ExtractedText
+from utils import extract_text_from_image, extract_pdf_pages, pdf_page_count
+from embeded_store import get_user_store, VectorStore
+
+# Processes used for extraction, and jobs (uploads) handled at the same time
+INGEST_PROCESSES = int(os.getenv("INGEST_PROCESSES", str(os.cpu_count() or 2)))
+INGEST_JOBS = int(os.getenv("INGEST_JOBS", "4"))
+# Max pages per extraction task; PDFs are split so every process gets a share
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "20"))
+# Re-queue pending documents on start; with several workers, enable it on one only
+INGEST_RESUME = os.getenv("INGEST_RESUME", "1") == "1"
+
+# -------------------- VECTOR INDEX --------------------
+def load_user_index(db: Session, user_id: int) -> VectorStore:
+    """
+    Return the user's vector store, loading it from disk (or embedding their
+    existing texts once, if no index was saved yet) on first use.
+    """
+    store = get_user_store(user_id)
+    store.ensure_loaded(lambda: (
+        db.query(ExtractedText.id, ExtractedText.document_id, ExtractedText.content, ExtractedText.version)
+        .join(Document)
+        .filter(Document.user_id == user_id)
+        .all()
+    ))
+    return store
+
+def open_user_index(user_id: int) -> VectorStore:
+    """
+    load_user_index() for callers without a sync session (async handlers, via the threadpool).
+    """
+    store = get_user_store(user_id)
+    if store.loaded:
+        return store
+    db = SessionLocal()
+    try:
+        return load_user_index(db, user_id)
+    finally:
+        db.close()
+
+def index_text_entry(db: Session, user_id: int, text_entry: ExtractedText):
+    load_user_index(db, user_id).add_documents(
+        text_entry.content, text_id=text_entry.id, document_id=text_entry.document_id, version=text_entry.version
+    )
+
+def copy_extracted_texts(db: Session, source_id: int, document_id: int) -> List[ExtractedText]:
+    """
+    Give a deduplicated upload its own copy of the source document's page texts.
+    """
+    rows = (
+        db.query(ExtractedText.content, ExtractedText.page_number)
+        .filter(ExtractedText.document_id == source_id)
+        .order_by(ExtractedText.page_number, ExtractedText.id)
+        .all()
+    )
+    text_entries = [ExtractedText(document_id=document_id, content=c, page_number=p) for c, p in rows]
+    db.add_all(text_entries)
+    return text_entries
+
+def unindex_document(user_id: int, document_id: int):
+    # Nothing to remove if the user's index was never built
+    store = get_user_store(user_id)
+    if store.ensure_loaded():
+        store.remove_document(document_id)
+
+# -------------------- JOB QUEUE --------------------
+_process_pool: Optional[ProcessPoolExecutor] = None
+_job_pool = ThreadPoolExecutor(max_workers=INGEST_JOBS, thread_name_prefix="ingest")
+_pool_lock = threading.Lock()
+
+jobs: Dict[int, dict] = {}  # document_id -> job progress
+_jobs_lock = threading.Lock()
+
+def get_process_pool() -> ProcessPoolExecutor:
+    # "spawn" so workers don't inherit the embedding model and torch threads
+    global _process_pool
+    with _pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(
+                max_workers=INGEST_PROCESSES, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _process_pool
+
+def _update_job(document_id: int, **fields):
+    with _jobs_lock:
+        jobs.setdefault(document_id, {}).update(fields)
+
+def get_job(document_id: int) -> Optional[dict]:
+    with _jobs_lock:
+        job = jobs.get(document_id)
+        return dict(job) if job else None
+
+def submit_ingest(document_id: int, user_id: int, kind: str, file_path: str):
+    """
+    Queue extraction + indexing of an uploaded file for a pending Document.
+    """
+    _update_job(document_id, status="pending", stage="queued", progress=0.0, error=None,
+                queued_at=datetime.utcnow(), finished_at=None)
+    _job_pool.submit(_run_job, document_id, user_id, kind, file_path)
+
+def resume_pending_jobs() -> int:
+    """
+    Queue the documents still "pending" from a previous run again, or mark them
+    failed if their file is gone. Returns the number of jobs queued.
+    """
+    db = SessionLocal()
+    try:
+        queued = 0
+        for doc in db.query(Document).filter(Document.status == "pending").all():
+            if doc.user_id is None or not doc.path or not os.path.exists(doc.path):
+                doc.status = "failed"
+                _update_job(doc.id, status="failed", stage="done", error="Uploaded file is missing",
+                            finished_at=datetime.utcnow())
+                continue
+            submit_ingest(doc.id, doc.user_id, doc.type, doc.path)
+            queued += 1
+        db.commit()
+        return queued
+    finally:
+        db.close()
+
+def _extract_pages(document_id: int, kind: str, file_path: str) -> List[Optional[str]]:
+    """
+    Return the text of each page (a single page for images), extracting page
+    ranges of a PDF in parallel.
+    """
+    pool = get_process_pool()
+    if kind == "image":
+        return [pool.submit(extract_text_from_image, file_path).result()]
+
+    count = pdf_page_count(file_path)
+    # Scanned pages are OCRed inside the tasks, so spread even short PDFs over all processes
+    step = max(1, min(PDF_PAGES_PER_TASK, -(-count // INGEST_PROCESSES)))
+    futures = [
+        pool.submit(extract_pdf_pages, file_path, start, start + step)
+        for start in range(0, count, step)
+    ]
+    pages = []
+    for i, future in enumerate(futures, 1):
+        pages.extend(future.result())
+        _update_job(document_id, progress=round(0.1 + 0.5 * i / len(futures), 3))
+    return pages
+
+def _run_job(document_id: int, user_id: int, kind: str, file_path: str):
+    db = SessionLocal()
+    try:
+        # Rows already saved by an interrupted run: only the embedding is left to do
+        rows = (
+            db.query(ExtractedText.id, ExtractedText.document_id, ExtractedText.content, ExtractedText.version)
+            .filter(ExtractedText.document_id == document_id)
+            .all()
+        )
+        if not rows:
+            _update_job(document_id, status="processing", stage="extracting", progress=0.1)
+            pages = _extract_pages(document_id, kind, file_path)
+        page_count = len(pages) if not rows else len(rows)
+
+        doc = db.query(Document).filter(Document.id == document_id).first()
+        if not doc:
+            # Deleted while the job was queued
+            _update_job(document_id, status="failed", stage="done", error="Document was deleted")
+            return
+
+        if not rows:
+            _update_job(document_id, stage="saving", progress=0.6)
+            # One row per page; images have no page number
+            text_entries = [
+                ExtractedText(document_id=document_id, content=content, page_number=i if kind == "pdf" else None)
+                for i, content in enumerate(pages, 1)
+                if content
+            ]
+            db.add_all(text_entries)
+            db.flush()
+            rows = [(t.id, t.document_id, t.content, t.version) for t in text_entries]
+            db.commit()
+
+        _update_job(document_id, status="processing", stage="embedding", progress=0.8, pages=page_count)
+        load_user_index(db, user_id).add_many(rows)
+
+        if not db.query(Document.id).filter(Document.id == document_id).first():
+            # Deleted while it was being embedded: its vectors were added after the delete removed them
+            unindex_document(user_id, document_id)
+            _update_job(document_id, status="failed", stage="done", error="Document was deleted")
+            return
+        doc.status = "processed"
+        db.commit()
+        _update_job(document_id, status="processed", stage="done", progress=1.0, finished_at=datetime.utcnow())
+    except Exception as e:
+        db.rollback()
+        doc = db.query(Document).filter(Document.id == document_id).first()
+        if doc:
+            doc.status = "failed"
+            db.commit()
+        else:
+            unindex_document(user_id, document_id)
+        _update_job(document_id, status="failed", stage="done", error=str(e), finished_at=datetime.utcnow())
+    finally:
+        db.close()
+
+def shutdown():
+    _job_pool.shutdown(wait=False)
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False)
@@ -0,0 +1,129 @@
+"""
+Shared async client for chat completions.
+
+One AsyncOpenAI client with a pooled keep-alive HTTP connection pool is used
+for every request. Calls have per-request timeouts, wait on a global
+concurrency semaphore, and are retried with jittered exponential backoff on
+429, 5xx, timeouts and connection errors. Queue and latency counters are
+exposed through stats().
+"""
+
+import os
+import time
+import random
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Optional
+import httpx
+from openai import AsyncOpenAI, APIConnectionError, APIStatusError, APITimeoutError, RateLimitError
+
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))            # seconds per attempt
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))  # in-flight model calls per worker
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE = 0.5   # seconds, doubled per attempt
+LLM_BACKOFF_MAX = 8.0
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, (RateLimitError, APITimeoutError, APIConnectionError)):
+        return True
+    return isinstance(error, APIStatusError) and error.status_code >= 500
+
+
+class LLMClient:
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self._client: Optional[AsyncOpenAI] = None
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.waiting = 0
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.queue_seconds = 0.0
+        self.latency_seconds = 0.0
+
+    def _get_client(self) -> AsyncOpenAI:
+        if self._client is None:
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency),
+                timeout=httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+            )
+            # Retries are handled here so they share the semaphore slot and metrics
+            self._client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=http_client, max_retries=0)
+        return self._client
+
+    @asynccontextmanager
+    async def _slot(self):
+        self.waiting += 1
+        queued_at = time.perf_counter()
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        started = time.perf_counter()
+        self.queue_seconds += started - queued_at
+        self.in_flight += 1
+        self.requests += 1
+        try:
+            yield
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self.latency_seconds += time.perf_counter() - started
+            self._semaphore.release()
+
+    async def _create(self, **kwargs):
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            try:
+                return await self._get_client().chat.completions.create(timeout=LLM_TIMEOUT, **kwargs)
+            except Exception as e:
+                if attempt == LLM_MAX_RETRIES or not _is_retryable(e):
+                    raise
+                self.retries += 1
+                delay = min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt)
+                await asyncio.sleep(random.uniform(0, delay))  # full jitter
+
+    async def complete(self, messages: List[dict], temperature: float, max_tokens: int = 500) -> str:
+        async with self._slot():
+            response = await self._create(
+                model=LLM_MODEL, messages=messages, temperature=temperature, max_tokens=max_tokens
+            )
+        return response.choices[0].message.content.strip()
+
+    async def stream(self, messages: List[dict], temperature: float, max_tokens: int = 500) -> AsyncIterator[str]:
+        """
+        Yield answer tokens. Only opening the stream is retried, never a partly sent answer.
+        """
+        async with self._slot():
+            stream = await self._create(
+                model=LLM_MODEL, messages=messages, temperature=temperature, max_tokens=max_tokens, stream=True
+            )
+            async for chunk in stream:
+                token = chunk.choices[0].delta.content if chunk.choices else None
+                if token:
+                    yield token
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "waiting": self.waiting,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "errors": self.errors,
+            "retries": self.retries,
+            "avg_queue_ms": round(1000 * self.queue_seconds / self.requests, 1) if self.requests else 0,
+            "avg_latency_ms": round(1000 * self.latency_seconds / self.requests, 1) if self.requests else 0,
+        }
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+
+llm = LLMClient()
@@ -1,22 +1,46 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Query, Depends, Path, Body
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Query, Depends, Path, Body, BackgroundTasks, Response
+from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from starlette.background import BackgroundTask
 from fastapi.security import OAuth2PasswordBearer
-from models import SessionLocal, Document, ExtractedText, Question, User, TextHistory
-from utils import save_upload_file, extract_text_from_pdf, extract_text_from_image, clean_text
-from sqlalchemy.orm import joinedload, Session
+from models import (
+    SessionLocal, AsyncSessionLocal, Document, ExtractedText, Question, User, TextHistory, ConversationSession,
+    FTS_ENABLED, run_migrations
+)
+from utils import save_upload_file, store_blob, blob_path, blob_lock, read_upload_text, clean_text
+from sqlalchemy import text as sql_text, bindparam, select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, undefer
 from datetime import datetime, timedelta
 from pydantic import BaseModel
 from jose import JWTError, jwt
 from dotenv import load_dotenv
 from models import QuestionSource 
-import openai
-import os, random, smtplib
+import os, re, json, random, smtplib, hashlib, asyncio
+from typing import Dict, List, Optional
 from email.mime.text import MIMEText
-from open_sources.wikipedia_client import wikipedia_summary_for
+from open_sources.wikipedia_client import aclose as close_wikipedia_client
+from open_sources.registry import gather_sources, get_provider_stats, close_providers
+from embeded_store import VectorStore, get_user_store, embedding_pipeline, embedding_cache
+from retrieval import hybrid_search, hybrid_search_many, rerank
+from llm_client import llm, LLM_MODEL
+from answer_cache import answer_cache
+from prompt_builder import build_context, context_budget, count_tokens
+from conversation import (
+    get_session, load_turns, select_turns, history_messages, previous_chunks, record_turn, refresh_summary
+)
+from ingest import (
+    open_user_index, index_text_entry, unindex_document, copy_extracted_texts, submit_ingest, get_job,
+    resume_pending_jobs, shutdown as shutdown_ingest, INGEST_RESUME
+)
 
 # -------------------- APP SETUP --------------------
+# Single-node setups migrate on start; multi-node deployments run `alembic upgrade head` once instead
+if os.getenv("DB_AUTO_MIGRATE", "1") == "1":
+    run_migrations()
+
 app = FastAPI()
 
 # CORS
@@ -26,14 +50,14 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Load environment variables
 load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
 
 # -------------------- FRONTEND BUILD --------------------
-frontend_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "frontend", "dist")
+frontend_path = os.getenv("FRONTEND_DIST_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "frontend", "dist"))
 assets_path = os.path.join(frontend_path, "assets")
 
 if not os.path.exists(frontend_path):
@@ -69,6 +93,11 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    # Handlers on the hot paths await the database instead of holding a threadpool worker
+    async with AsyncSessionLocal() as db:
+        yield db
+
 # -------------------- OTP CONFIG --------------------
 otp_store = {}  # temporary in-memory store
 
@@ -186,12 +215,12 @@ def verify_otp(req: VerifyOtpRequest, db: Session = Depends(get_db)):
     return {"message": "Email verified successfully. You can now login."}
 
 # -------------------- GET CURRENT USER --------------------
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
     payload = verify_token(token)
     if not payload:
         raise HTTPException(status_code=401, detail="Invalid token")
     user_id = int(payload.get("sub"))
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return user
@@ -200,13 +229,27 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
 settings = {
     "prompt": "You are answering based on uploaded documents. Answer clearly and concisely.",
     "temperature": 0.7,
-    "top_k": 40
+    "top_k": 40,
+    "retrieval_top_k": 8,      # chunks retrieved per question
+    "context_tokens": 3000,    # token budget for document context in the prompt
+    "compress_over_tokens": 0, # compress chunks longer than this to their relevant sentences (0 = off)
+    "rerank": False,           # rescore first-stage candidates with a cross-encoder
+    "rerank_candidates": 20,   # first-stage candidates passed to the reranker
+    "rerank_top_k": 3,         # chunks kept after reranking
+    "rerank_budget_ms": 250    # fall back to first-stage order past this
 }
 
 class SettingsUpdate(BaseModel):
     prompt: str = None
     temperature: float = None
     top_k: int = None
+    retrieval_top_k: int = None
+    context_tokens: int = None
+    compress_over_tokens: int = None
+    rerank: bool = None
+    rerank_candidates: int = None
+    rerank_top_k: int = None
+    rerank_budget_ms: int = None
 
 @app.get("/settings")
 def get_settings():
@@ -214,31 +257,115 @@ def get_settings():
 
 @app.post("/settings")
 def update_settings(update: SettingsUpdate):
-    if update.prompt is not None:
-        settings["prompt"] = update.prompt
-    if update.temperature is not None:
-        settings["temperature"] = update.temperature
-    if update.top_k is not None:
-        settings["top_k"] = update.top_k
+    for key, value in update.model_dump(exclude_none=True).items():
+        settings[key] = value
     return {"message": "Settings updated", "settings": settings}
 
+# -------------------- PROMPT CONTEXT --------------------
+def retrieve_chunks(store: VectorStore, question: str) -> list:
+    """
+    Hybrid first-stage retrieval, then cross-encoder reranking if enabled in settings.
+    """
+    if not settings["rerank"]:
+        return hybrid_search(store, question, top_k=settings["retrieval_top_k"])
+    candidates = hybrid_search(store, question, top_k=settings["rerank_candidates"])
+    return rerank(question, candidates, settings["rerank_top_k"], settings["rerank_budget_ms"])
+
+def retrieve_chunks_many(store: VectorStore, questions: list) -> list:
+    """
+    retrieve_chunks() for several questions with one batched embedding and index search.
+    """
+    if not settings["rerank"]:
+        return hybrid_search_many(store, questions, top_k=settings["retrieval_top_k"])
+    candidates = hybrid_search_many(store, questions, top_k=settings["rerank_candidates"])
+    return [
+        rerank(q, c, settings["rerank_top_k"], settings["rerank_budget_ms"])
+        for q, c in zip(questions, candidates)
+    ]
+
+@app.get("/metrics/llm")
+def get_llm_metrics():
+    return llm.stats()
+
+@app.get("/metrics/answer-cache")
+def get_answer_cache_metrics():
+    return answer_cache.stats()
+
+@app.get("/metrics/embedding")
+def get_embedding_metrics():
+    return {**embedding_pipeline.stats(), **embedding_cache.stats()}
+
+@app.get("/metrics/open-sources")
+def get_open_source_metrics():
+    return get_provider_stats()
+
+# -------------------- PAGINATION --------------------
+# List endpoints return a page as a plain JSON array (as before) and the cursor
+# for the next page in the X-Next-Cursor header; pass it back as ?cursor=.
+PAGE_DEFAULT_LIMIT = 100
+PAGE_MAX_LIMIT = 500
+
+def select_fields(fields: Optional[str], available: Dict[str, object], default: List[str]) -> List[str]:
+    """
+    Response fields requested as ?fields=a,b (id is always included), so large
+    text columns are only read when asked for.
+    """
+    if not fields:
+        return default
+    names = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [n for n in names if n not in available]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return ["id"] + [n for n in names if n != "id"]
+
+def keyset_page(available: Dict[str, object], names: List[str], where: list, cursor: Optional[int], limit: int):
+    """
+    Rows after the cursor id, in id order; one extra row tells whether another page exists.
+    """
+    id_column = available["id"]
+    stmt = select(*(available[n].label(n) for n in names)).where(*where)
+    if cursor is not None:
+        stmt = stmt.where(id_column > cursor)
+    return stmt.order_by(id_column).limit(limit + 1)
+
+def page_result(rows, limit: int, response: Response) -> list:
+    page = [dict(row._mapping) for row in rows[:limit]]
+    if len(rows) > limit:
+        response.headers["X-Next-Cursor"] = str(page[-1]["id"])
+    return page
+
 # -------------------- SAVE Q&A --------------------
 class QnAItem(BaseModel):
     question: str
     answer: str
 
 @app.post("/save")
-def save_qna(item: QnAItem, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def save_qna(item: QnAItem, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
     q_entry = Question(question_text=item.question, answer_text=item.answer, user_id=current_user.id)
     db.add(q_entry)
-    db.commit()
-    db.refresh(q_entry)
+    await db.commit()
     return {"message": "Saved successfully", "question_id": q_entry.id}
 
+SAVED_FIELDS = {
+    "id": Question.id,
+    "question": Question.question_text,
+    "answer": Question.answer_text,
+    "created_at": Question.created_at,
+    "session_id": Question.session_id,
+}
+
 @app.get("/saved")
-def get_saved(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    saved_items = db.query(Question).filter(Question.user_id == current_user.id).all()
-    return [{"id": q.id, "question": q.question_text, "answer": q.answer_text} for q in saved_items]
+async def get_saved(
+    response: Response,
+    cursor: Optional[int] = Query(None),
+    limit: int = Query(PAGE_DEFAULT_LIMIT, ge=1, le=PAGE_MAX_LIMIT),
+    fields: Optional[str] = Query(None, description="Comma-separated, e.g. id,question"),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    names = select_fields(fields, SAVED_FIELDS, ["id", "question", "answer"])
+    stmt = keyset_page(SAVED_FIELDS, names, [Question.user_id == current_user.id], cursor, limit)
+    return page_result((await db.execute(stmt)).all(), limit, response)
 
 @app.delete("/saved/{q_id}")
 def delete_saved(q_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
@@ -250,127 +377,478 @@ def delete_saved(q_id: int, current_user: User = Depends(get_current_user), db:
     return {"message": "Deleted successfully"}
 
 # -------------------- ASK QUESTION WITH REFERENCES --------------------
+NO_DOCUMENTS_ANSWER = "No documents uploaded to answer from."
 
-@app.post("/ask")
-def ask_question(
-    data: dict = Body(...),
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
-):
-    question = data.get("question")
-    if not question:
-        raise HTTPException(status_code=400, detail="Question is required")
-
-    # Get all texts of user documents
-    all_texts = db.query(ExtractedText).join(Document).filter(Document.user_id == current_user.id).all()
-    combined_text = "\n".join([t.content for t in all_texts if t.content])
-
-    if not combined_text.strip():
-        # 🔁 Fallback to Wikipedia (open-source) when no local docs are available
-        wiki = wikipedia_summary_for(question)
-        if wiki:
-            title, summary = wiki
-            try:
-                response = openai.chat.completions.create(
-                    model="gpt-4",
-                    messages=[
-                        {"role": "system", "content": settings['prompt']},
-                        {"role": "user", "content": f"Public Knowledge (Wikipedia - {title}):\n{summary}\n\nQuestion:\n{question}"}
-                    ],
-                    temperature=settings["temperature"],
-                    max_tokens=500
-                )
-                answer_text = response.choices[0].message.content.strip()
-            except Exception as e:
-                raise HTTPException(status_code=500, detail=f"Model error: {e}")
-
-            # Save Q&A even though it came from public source (no doc refs)
-            q_entry = Question(question_text=question, answer_text=answer_text, user_id=current_user.id)
-            db.add(q_entry)
-            db.commit()
-            db.refresh(q_entry)
-
-            return {
-                "question_id": q_entry.id,
-                "question": question,
-                "answer": answer_text,
-                "references": [],
-                "source": "wikipedia"
-            }
+def external_context(results: list, question: str, token_budget: int):
+    blocks = [{"text": f"Public Knowledge ({r.provider} - {r.title}):\n{r.text}"} for r in results]
+    text, _, tokens = build_context(blocks, question, token_budget)
+    return text, tokens
 
-        # If Wikipedia also fails, return fallback message
-        return {"answer": "No documents uploaded to answer from."}
+def chunks_match(chunks: list) -> bool:
+    # Vector search always returns neighbours; a keyword hit means the documents actually cover the question
+    return any("lexical_rank" in c or c.get("reused") for c in chunks)
 
-    try:
-        response = openai.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": settings['prompt']},
-                {"role": "user", "content": f"Documents:\n{combined_text}\n\nQuestion:\n{question}"}
-            ],
-            temperature=settings["temperature"],
-            max_tokens=500
-        )
-        answer_text = response.choices[0].message.content.strip()
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Model error: {e}")
+def merge_session_chunks(chunks: list, prior: list) -> list:
+    """
+    A follow-up that matches nothing new is answered from the previous turn's
+    chunks; otherwise those chunks fill in after the new ones.
+    """
+    if not prior:
+        return chunks
+    if not chunks_match(chunks):
+        return prior
+    seen = {c["id"] for c in chunks}
+    return chunks + [c for c in prior if c["id"] not in seen]
+
+async def load_history(db: AsyncSession, user_id: int, session: ConversationSession, question: str) -> list:
+    turns = select_turns(await load_turns(db, user_id, session.id), question)
+    return history_messages(session, turns)
+
+async def user_index(user_id: int) -> VectorStore:
+    # Loading (or first-time embedding) is disk/CPU work; later calls return the loaded store directly
+    store = get_user_store(user_id)
+    if store.loaded:
+        return store
+    return await run_in_threadpool(open_user_index, user_id)
+
+async def prepare_answer(db: AsyncSession, user_id: int, question: str, session: ConversationSession = None):
+    """
+    Retrieve context for a question and build the chat messages within the token budget.
+    With a session, the conversation summary and relevant past turns are sent too.
+    Returns (messages, used_chunks, source, token_usage) or None if there is nothing to answer from.
+    source is "documents", "external" or "documents+external".
+    """
+    # Retrieve only the most relevant chunks of the user's documents (CPU work → threadpool)
+    store = await user_index(user_id)
+    chunks = await run_in_threadpool(retrieve_chunks, store, question)
+    history = []
+    if session is not None:
+        history = await load_history(db, user_id, session, question)
+        chunks = merge_session_chunks(chunks, previous_chunks(session, store))
+    return await compose_messages(question, chunks, history)
+
+async def compose_messages(question: str, chunks: list, history: list = ()):
+    """
+    Build the chat messages for already retrieved chunks (see prepare_answer).
+    """
+    budget = context_budget(settings["context_tokens"], settings["prompt"], question, *(m["content"] for m in history))
+    combined_text, used_chunks, used_tokens = await run_in_threadpool(
+        build_context, chunks, question, budget, settings["compress_over_tokens"]
+    )
 
-    # Save Q&A
-    q_entry = Question(question_text=question, answer_text=answer_text, user_id=current_user.id)
+    if used_chunks and chunks_match(used_chunks):
+        user_content = f"Documents:\n{combined_text}\n\nQuestion:\n{question}"
+        source = "documents"
+    else:
+        # 🔁 No documents, or none that match → ask the external knowledge sources in parallel
+        results = await gather_sources(question)
+        extra_text, extra_tokens = external_context(results, question, budget - used_tokens)
+        used_tokens += extra_tokens
+        if used_chunks and extra_text:
+            user_content = f"Documents:\n{combined_text}\n\n{extra_text}\n\nQuestion:\n{question}"
+            source = "documents+external"
+        elif used_chunks:
+            user_content = f"Documents:\n{combined_text}\n\nQuestion:\n{question}"
+            source = "documents"
+        elif extra_text:
+            user_content = f"{extra_text}\n\nQuestion:\n{question}"
+            source = "external"
+        else:
+            return None
+
+    messages = [
+        {"role": "system", "content": settings['prompt']},
+        *history,
+        {"role": "user", "content": user_content}
+    ]
+    token_usage = {
+        "context_used": used_tokens,
+        "context_available": budget,
+        "prompt": sum(count_tokens(m["content"]) for m in messages),
+    }
+    return messages, used_chunks, source, token_usage
+
+def answer_settings_key(messages: list) -> tuple:
+    # Settings (and conversation history) that change the model's answer for the same context
+    history = messages[1:-1]
+    history_key = hashlib.sha256(json.dumps(history).encode()).hexdigest() if history else ""
+    return (settings["prompt"], settings["temperature"], LLM_MODEL, history_key)
+
+def select_references(used_chunks: list) -> list:
+    # Top 3 retrieved chunks, one per document
+    matched_chunks = []
+    seen_docs = set()
+    for chunk in used_chunks:
+        if chunk["document_id"] in seen_docs:
+            continue
+        seen_docs.add(chunk["document_id"])
+        matched_chunks.append(chunk)
+        if len(matched_chunks) == 3:
+            break
+    return matched_chunks
+
+async def add_answer(db: AsyncSession, user_id: int, question: str, answer_text: str, used_chunks: list, session_id: int = None):
+    """
+    Add the Q&A and its QuestionSource rows (with their fused score) without committing.
+    Returns (question, matched chunks).
+    """
+    q_entry = Question(question_text=question, answer_text=answer_text, user_id=user_id, session_id=session_id)
     db.add(q_entry)
-    db.flush()  # get q_entry.id before commit
-
-    # Store references (top 3 matched chunks)
-    matched_chunks = [
-        t for t in all_texts if question.lower() in (t.content or "").lower()
-    ][:3]
+    await db.flush()  # get q_entry.id before commit
+    if session_id:
+        await record_turn(db, session_id, question, used_chunks)
 
+    matched_chunks = select_references(used_chunks)
     for chunk in matched_chunks:
         ref = QuestionSource(
             question_id=q_entry.id,
-            document_id=chunk.document_id,
-            relevance_score=1.0
+            document_id=chunk["document_id"],
+            relevance_score=chunk["score"]
         )
         db.add(ref)
+    return q_entry, matched_chunks
 
-    db.commit()
-    db.refresh(q_entry)
-
-    # Prepare references for frontend
-    refs = [
+async def reference_lookup(db: AsyncSession, chunks: list):
+    """
+    Document names and page numbers for chunks, in two queries. Returns (doc_names, page_numbers).
+    """
+    if not chunks:
+        return {}, {}
+    doc_names = dict((await db.execute(
+        select(Document.id, Document.name).where(Document.id.in_({c["document_id"] for c in chunks}))
+    )).all())
+    page_numbers = dict((await db.execute(
+        select(ExtractedText.id, ExtractedText.page_number).where(ExtractedText.id.in_({c["text_id"] for c in chunks}))
+    )).all())
+    return doc_names, page_numbers
+
+def format_references(matched_chunks: list, doc_names: dict, page_numbers: dict) -> list:
+    return [
         {
-            "document_id": chunk.document_id,
-            "document_name": chunk.document.name if hasattr(chunk, "document") else "Document",
-            "snippets": [chunk.content[:300]]
+            "document_id": chunk["document_id"],
+            "document_name": doc_names.get(chunk["document_id"], "Document"),
+            "page_number": page_numbers.get(chunk["text_id"]),
+            "snippets": [chunk["text"][:300]]
         }
         for chunk in matched_chunks
     ]
 
-    return {
-        "question_id": q_entry.id,
+async def save_answer(db: AsyncSession, user_id: int, question: str, answer_text: str, used_chunks: list, session_id: int = None):
+    """
+    Persist the Q&A with its references. Returns (question_id, references for the frontend).
+    """
+    q_entry, matched_chunks = await add_answer(db, user_id, question, answer_text, used_chunks, session_id)
+    await db.commit()
+
+    # Prepare references for frontend
+    return q_entry.id, format_references(matched_chunks, *await reference_lookup(db, matched_chunks))
+
+async def find_session(db: AsyncSession, user_id: int, session_id) -> ConversationSession:
+    if session_id is None:
+        return None
+    session = await get_session(db, user_id, session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return session
+
+@app.post("/ask")
+async def ask_question(
+    background_tasks: BackgroundTasks,
+    data: dict = Body(...),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    question = data.get("question")
+    if not question:
+        raise HTTPException(status_code=400, detail="Question is required")
+    session = await find_session(db, current_user.id, data.get("session_id"))
+    session_id = session.id if session else None
+
+    # Database, model and external source calls are awaited; only retrieval uses the threadpool
+    prepared = await prepare_answer(db, current_user.id, question, session)
+    if not prepared:
+        return {"answer": NO_DOCUMENTS_ANSWER}
+    messages, used_chunks, source, token_usage = prepared
+
+    # Same question over the same chunks and settings (or a near-identical question) → cached answer
+    generation = get_user_store(current_user.id).generation
+    cache_key = answer_cache.make_key(current_user.id, question, used_chunks, answer_settings_key(messages))
+    cached = await run_in_threadpool(answer_cache.get, cache_key, question, generation)
+    if cached:
+        answer_text, used_chunks = cached["answer"], cached["chunks"]
+    else:
+        try:
+            answer_text = await llm.complete(messages, temperature=settings["temperature"])
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Model error: {e}")
+        await run_in_threadpool(answer_cache.put, cache_key, question, answer_text, used_chunks, generation)
+
+    question_id, refs = await save_answer(db, current_user.id, question, answer_text, used_chunks, session_id)
+    if session_id:
+        background_tasks.add_task(refresh_summary, session_id)
+    result = {
+        "question_id": question_id,
+        "session_id": session_id,
         "question": question,
         "answer": answer_text,
-        "references": refs
+        "references": refs,
+        "cached": bool(cached),
+        "tokens": token_usage
     }
+    if source != "documents":
+        result["source"] = source
+    return result
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+async def save_answer_in_new_session(user_id: int, question: str, answer_text: str, used_chunks: list, session_id: int = None):
+    async with AsyncSessionLocal() as db:
+        return await save_answer(db, user_id, question, answer_text, used_chunks, session_id)
+
+@app.post("/ask/stream")
+async def ask_question_stream(
+    data: dict = Body(...),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Same as /ask, but streams the answer as Server-Sent Events: "token" events
+    while the model generates, then one "done" event with question_id and
+    references (the Q&A is saved once the stream completes).
+    """
+    question = data.get("question")
+    if not question:
+        raise HTTPException(status_code=400, detail="Question is required")
+    session = await find_session(db, current_user.id, data.get("session_id"))
+    session_id = session.id if session else None
+
+    prepared = await prepare_answer(db, current_user.id, question, session)
+    user_id = current_user.id
+
+    async def event_stream():
+        if not prepared:
+            yield sse_event("token", {"token": NO_DOCUMENTS_ANSWER})
+            yield sse_event("done", {"question_id": None, "references": []})
+            return
+        messages, used_chunks, source, token_usage = prepared
+
+        generation = get_user_store(user_id).generation
+        cache_key = answer_cache.make_key(user_id, question, used_chunks, answer_settings_key(messages))
+        cached = await run_in_threadpool(answer_cache.get, cache_key, question, generation)
+        if cached:
+            answer_text, used_chunks = cached["answer"], cached["chunks"]
+            yield sse_event("token", {"token": answer_text})
+        else:
+            parts = []
+            try:
+                async for token in llm.stream(messages, temperature=settings["temperature"]):
+                    parts.append(token)
+                    yield sse_event("token", {"token": token})
+            except Exception as e:
+                yield sse_event("error", {"detail": f"Model error: {e}"})
+                return
+            answer_text = "".join(parts).strip()
+            await run_in_threadpool(answer_cache.put, cache_key, question, answer_text, used_chunks, generation)
+
+        # The request's session is closed once streaming starts, so save with a fresh one
+        question_id, refs = await save_answer_in_new_session(user_id, question, answer_text, used_chunks, session_id)
+        yield sse_event("done", {
+            "question_id": question_id, "session_id": session_id, "references": refs, "source": source,
+            "cached": bool(cached), "tokens": token_usage
+        })
+
+    # The summary refresh (if due) runs once the stream has finished
+    background = BackgroundTask(refresh_summary, session_id) if session_id else None
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"},
+                             background=background)
+
+# -------------------- BATCH ASK --------------------
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "1000"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))  # model calls in flight per batch
+
+class BatchAskRequest(BaseModel):
+    questions: List[str]
+
+async def save_answers_in_new_session(user_id: int, answered: list) -> list:
+    """
+    Persist (question, answer_text, used_chunks) tuples in one transaction. Returns their question ids.
+    """
+    async with AsyncSessionLocal() as db:
+        entries = [(await add_answer(db, user_id, q, a, chunks))[0] for q, a, chunks in answered]
+        await db.commit()
+        return [q.id for q in entries]
+
+@app.post("/ask/batch")
+async def ask_batch(
+    req: BatchAskRequest,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Answer many questions at once, streamed as NDJSON: one line per question as
+    soon as its answer is ready (with its "index" in the request), then a final
+    {"done": true, "question_ids": [...]} line once all Q&As are saved together.
+    """
+    questions = [q.strip() for q in req.questions]
+    if not questions or not all(questions):
+        raise HTTPException(status_code=400, detail="Questions must be non-empty")
+    if len(questions) > BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_QUESTIONS} questions per batch")
+
+    # One embedding + search pass for the whole batch, and one lookup for reference names
+    user_id = current_user.id
+    store = await user_index(user_id)
+    all_chunks = await run_in_threadpool(retrieve_chunks_many, store, questions)
+    doc_names, page_numbers = await reference_lookup(db, [c for chunks in all_chunks for c in chunks])
+    generation = store.generation
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def answer_one(index: int, question: str, chunks: list) -> dict:
+        async with semaphore:
+            result = {"index": index, "question": question}
+            try:
+                prepared = await compose_messages(question, chunks)
+                if not prepared:
+                    return dict(result, answer=NO_DOCUMENTS_ANSWER, references=[], used_chunks=None)
+                messages, used_chunks, source, token_usage = prepared
+                cache_key = answer_cache.make_key(user_id, question, used_chunks, answer_settings_key(messages))
+                cached = await run_in_threadpool(answer_cache.get, cache_key, question, generation)
+                if cached:
+                    answer_text, used_chunks = cached["answer"], cached["chunks"]
+                else:
+                    answer_text = await llm.complete(messages, temperature=settings["temperature"])
+                    await run_in_threadpool(answer_cache.put, cache_key, question, answer_text, used_chunks, generation)
+            except Exception as e:
+                return dict(result, error=f"Model error: {e}", used_chunks=None)
+            return dict(
+                result,
+                answer=answer_text,
+                references=format_references(select_references(used_chunks), doc_names, page_numbers),
+                source=source,
+                cached=bool(cached),
+                tokens=token_usage,
+                used_chunks=used_chunks,
+            )
+
+    async def result_stream():
+        tasks = [asyncio.create_task(answer_one(i, q, c)) for i, (q, c) in enumerate(zip(questions, all_chunks))]
+        answered = {}
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                used_chunks = result.pop("used_chunks")
+                if used_chunks is not None:
+                    answered[result["index"]] = (result["question"], result["answer"], used_chunks)
+                yield json.dumps(result, default=str) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()  # client went away
+
+        order = sorted(answered)
+        ids = await save_answers_in_new_session(user_id, [answered[i] for i in order])
+        question_ids = [None] * len(questions)
+        for i, question_id in zip(order, ids):
+            question_ids[i] = question_id
+        yield json.dumps({"done": True, "question_ids": question_ids}) + "\n"
+
+    return StreamingResponse(result_stream(), media_type="application/x-ndjson")
+
+# -------------------- CONVERSATION SESSIONS --------------------
+class SessionCreate(BaseModel):
+    title: str = None
+
+@app.post("/sessions")
+async def create_session(item: SessionCreate = Body(None), current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    session = ConversationSession(user_id=current_user.id, title=item.title if item else None)
+    db.add(session)
+    await db.commit()
+    return {"session_id": session.id, "title": session.title}
+
+@app.get("/sessions")
+async def list_sessions(current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    sessions = (await db.scalars(
+        select(ConversationSession)
+        .where(ConversationSession.user_id == current_user.id)
+        .order_by(ConversationSession.updated_at.desc())
+    )).all()
+    return [
+        {"id": s.id, "title": s.title, "turns": s.turn_count, "updated_at": s.updated_at}
+        for s in sessions
+    ]
+
+@app.get("/sessions/{session_id}")
+async def get_session_turns(session_id: int = Path(..., gt=0), current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    session = await find_session(db, current_user.id, session_id)
+    turns = await load_turns(db, current_user.id, session.id, limit=None)
+    return {
+        "id": session.id,
+        "title": session.title,
+        "summary": session.summary,
+        "turns": [
+            {"question_id": t.id, "question": t.question_text, "answer": t.answer_text, "created_at": t.created_at}
+            for t in turns
+        ]
+    }
+
+@app.delete("/sessions/{session_id}")
+def delete_session(session_id: int = Path(..., gt=0), current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    # Sync session: the ORM cascade to the session's questions and their sources loads them lazily
+    session = db.query(ConversationSession).filter(
+        ConversationSession.id == session_id, ConversationSession.user_id == current_user.id
+    ).first()
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    db.delete(session)
+    db.commit()
+    return {"message": "Session deleted"}
 
 
     
+# -------------------- DOCUMENT SNIPPETS --------------------
+def first_chunks_query(document_ids, per_document: int = 3, length: int = 300, where=None):
+    """
+    The first per_document chunks (by page) of every document in one query, with
+    ROW_NUMBER() per document and the snippet cut to length characters in SQL.
+    """
+    rank = func.row_number().over(
+        partition_by=ExtractedText.document_id, order_by=(ExtractedText.page_number, ExtractedText.id)
+    ).label("rn")
+    ranked = select(
+        ExtractedText.document_id, func.substr(ExtractedText.content, 1, length).label("snippet"), rank
+    ).where(ExtractedText.document_id.in_(document_ids))
+    if where is not None:
+        ranked = ranked.where(where)
+    ranked = ranked.subquery()
+    return (
+        select(ranked.c.document_id, ranked.c.snippet)
+        .where(ranked.c.rn <= per_document)
+        .order_by(ranked.c.document_id, ranked.c.rn)
+    )
+
+def group_snippets(rows) -> dict:
+    snippets = {}
+    for document_id, snippet in rows:
+        snippets.setdefault(document_id, []).append(snippet)
+    return snippets
+
 # -------------------- GET STORIES BY SOURCE --------------------
 @app.get("/stories-by-source")
 def get_stories_by_source(source: str = Query(...), current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    # Fetch documents matching the source
-    docs = db.query(Document).filter(Document.user_id == current_user.id, Document.name.ilike(f"%{source}%")).all()
-    
-    stories = []
-    for doc in docs:
-        # get top 3 text chunks for each document
-        chunks = db.query(ExtractedText).filter(ExtractedText.document_id == doc.id).limit(3).all()
-        stories.append({
+    # Fetch documents matching the source, then the top 3 text chunks of all of them at once
+    docs = db.query(Document.id, Document.name).filter(
+        Document.user_id == current_user.id, Document.name.ilike(f"%{source}%")
+    ).all()
+    snippets = group_snippets(db.execute(first_chunks_query([d.id for d in docs])).all()) if docs else {}
+
+    stories = [
+        {
             "document_id": doc.id,
             "document_name": doc.name,
-            "snippets": [c.content[:300] for c in chunks]
-        })
-    
+            "snippets": snippets.get(doc.id, [])
+        }
+        for doc in docs
+    ]
     return {"stories": stories}
 
 
@@ -378,88 +856,115 @@ def get_stories_by_source(source: str = Query(...), current_user: User = Depends
 # -------------------- GET REFERENCES FOR A QUESTION --------------------
 @app.get("/question/{q_id}/references")
 def get_references(q_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    q_entry = db.query(Question).filter(Question.id == q_id, Question.user_id == current_user.id).first()
+    q_entry = db.query(Question.id).filter(Question.id == q_id, Question.user_id == current_user.id).first()
     if not q_entry:
         raise HTTPException(status_code=404, detail="Question not found")
 
-    refs = (
-        db.query(QuestionSource)
-        .join(Document)
+    docs = (
+        db.query(Document.id, Document.name)
+        .join(QuestionSource, QuestionSource.document_id == Document.id)
         .filter(QuestionSource.question_id == q_id)
+        .order_by(QuestionSource.id)
         .all()
     )
+    snippets = group_snippets(db.execute(first_chunks_query([d.id for d in docs])).all()) if docs else {}
 
-    results = []
-    for ref in refs:
-        doc = db.query(Document).filter(Document.id == ref.document_id).first()
-        if doc:
-            chunks = db.query(ExtractedText).filter(ExtractedText.document_id == doc.id).limit(3).all()
-            results.append({
-                "document_id": doc.id,
-                "document_name": doc.name,
-                "snippets": [c.content[:300] for c in chunks]
-            })
-
+    results = [
+        {
+            "document_id": doc.id,
+            "document_name": doc.name,
+            "snippets": snippets.get(doc.id, [])
+        }
+        for doc in docs
+    ]
     return {"references": results}
 
 
 
 # -------------------- UPLOAD ENDPOINTS --------------------
+async def store_upload(file: UploadFile, kind: str, current_user: User, db: AsyncSession) -> Document:
+    """
+    Save an uploaded file by content hash. If the same bytes were already
+    processed (for any user), reuse that file's extracted text right away;
+    otherwise queue an extraction job.
+    """
+    temp_path, content_hash, size = await run_in_threadpool(save_upload_file, file)
+    file_path = blob_path(temp_path, content_hash)
+    source = (await db.execute(select(Document.id).where(
+        Document.content_hash == content_hash, Document.type == kind, Document.status == "processed"
+    ).limit(1))).first()
+
+    doc = Document(name=file.filename, type=kind, path=file_path, status="processed" if source else "pending",
+                   upload_date=datetime.utcnow(), user_id=current_user.id, content_hash=content_hash, size_bytes=size)
+    db.add(doc)
+    await db.flush()
+    if source:
+        text_entries = await db.run_sync(copy_extracted_texts, source.id, doc.id)
+        await db.flush()
+        rows = [(t.id, t.document_id, t.content, t.version) for t in text_entries]
+        await db.commit()
+        await run_in_threadpool(store_blob, temp_path, content_hash)  # only once the Document is committed
+        # Chunk embeddings come from the embedding cache, so nothing is re-encoded
+        store = await user_index(current_user.id)
+        await run_in_threadpool(store.add_many, rows)
+    else:
+        await db.commit()
+        await run_in_threadpool(store_blob, temp_path, content_hash)
+        submit_ingest(doc.id, current_user.id, kind, file_path)
+    return doc
+
 @app.post("/upload/pdf")
-async def upload_pdf(file: UploadFile = File(...), current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def upload_pdf(file: UploadFile = File(...), current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
     if not file.filename.endswith(".pdf"):
         raise HTTPException(400, "Only PDF files are allowed.")
-    file_path = save_upload_file(file)
-    extracted = clean_text(extract_text_from_pdf(file_path))
-    doc = Document(name=file.filename, type="pdf", path=file_path, status="processed", upload_date=datetime.utcnow(), user_id=current_user.id)
-    db.add(doc)
-    db.flush()
-    text_entry = ExtractedText(document_id=doc.id, content=extracted)
-    db.add(text_entry)
-    db.commit()
-    db.refresh(doc)
-    return {"message": "PDF uploaded and processed", "document_id": doc.id}
+    doc = await store_upload(file, "pdf", current_user, db)
+    if doc.status == "processed":
+        return {"message": "PDF uploaded and processed", "document_id": doc.id, "status": doc.status}
+    return {"message": "PDF uploaded, processing started", "document_id": doc.id, "status": doc.status}
 
 @app.post("/upload/image")
-async def upload_image(file: UploadFile = File(...), current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def upload_image(file: UploadFile = File(...), current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
     if not file.filename.lower().endswith((".jpg", ".jpeg", ".png")):
         raise HTTPException(400, "Only JPG or PNG files are allowed.")
-    file_path = save_upload_file(file)
-    extracted = clean_text(extract_text_from_image(file_path))
-    doc = Document(name=file.filename, type="image", path=file_path, status="processed", upload_date=datetime.utcnow(), user_id=current_user.id)
-    db.add(doc)
-    db.flush()
-    text_entry = ExtractedText(document_id=doc.id, content=extracted)
-    db.add(text_entry)
-    db.commit()
-    db.refresh(doc)
-    return {"message": "Image uploaded and processed", "document_id": doc.id}
+    doc = await store_upload(file, "image", current_user, db)
+    if doc.status == "processed":
+        return {"message": "Image uploaded and processed", "document_id": doc.id, "status": doc.status}
+    return {"message": "Image uploaded, processing started", "document_id": doc.id, "status": doc.status}
 
 @app.post("/upload/text")
-async def upload_text(name: str = Form(...), content: str = Form(...), current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def upload_text(name: str = Form(...), content: str = Form(...), current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
     cleaned_content = clean_text(content)
-    doc = Document(name=name, type="text", path="N/A", status="processed", upload_date=datetime.utcnow(), user_id=current_user.id)
+    raw = content.encode("utf-8")
+    doc = Document(name=name, type="text", path="N/A", status="processed", upload_date=datetime.utcnow(), user_id=current_user.id,
+                   content_hash=hashlib.sha256(raw).hexdigest(), size_bytes=len(raw))
     db.add(doc)
-    db.flush()
-    text_entry = ExtractedText(document_id=doc.id, content=cleaned_content)
+    await db.flush()
+    text_entry = ExtractedText(document_id=doc.id, content=cleaned_content, version=1)
     db.add(text_entry)
-    db.commit()
-    db.refresh(doc)
+    await db.commit()
+    store = await user_index(current_user.id)
+    await run_in_threadpool(
+        store.add_documents, text_entry.content, text_id=text_entry.id, document_id=doc.id, version=text_entry.version
+    )
     return {"message": "Text submitted successfully", "document_id": doc.id}
 
 @app.post("/upload/textfile")
-async def upload_text_file(file: UploadFile = File(...), current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def upload_text_file(file: UploadFile = File(...), current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
     if not file.filename.lower().endswith(".txt"):
         raise HTTPException(400, "Only .txt files are allowed.")
-    content = (await file.read()).decode("utf-8")
+    content, content_hash, size = await run_in_threadpool(read_upload_text, file)
     cleaned_content = clean_text(content)
-    doc = Document(name=file.filename, type="text", path="", upload_date=datetime.utcnow(), status="processed", user_id=current_user.id)
+    doc = Document(name=file.filename, type="text", path="", upload_date=datetime.utcnow(), status="processed", user_id=current_user.id,
+                   content_hash=content_hash, size_bytes=size)
     db.add(doc)
-    db.flush()
-    text_entry = ExtractedText(document_id=doc.id, content=cleaned_content)
+    await db.flush()
+    text_entry = ExtractedText(document_id=doc.id, content=cleaned_content, version=1)
     db.add(text_entry)
-    db.commit()
-    db.refresh(doc)
+    await db.commit()
+    store = await user_index(current_user.id)
+    await run_in_threadpool(
+        store.add_documents, text_entry.content, text_id=text_entry.id, document_id=doc.id, version=text_entry.version
+    )
     return {"message": "Text file uploaded and processed", "document_id": doc.id}
 
 
@@ -488,6 +993,7 @@ def add_plain_text(content: str, document_name: str = "free_text", current_user:
     db.add(new_text)
     db.commit()
     db.refresh(new_text)
+    index_text_entry(db, current_user.id, new_text)
 
     return {
         "message": "✅ Plain text added successfully.",
@@ -503,7 +1009,7 @@ def update_text(text_id: int, new_content: str, db: Session = Depends(get_db)):
     """
     Update text content and store old version in history.
     """
-    text_obj = db.query(ExtractedText).filter(ExtractedText.id == text_id).first()
+    text_obj = db.query(ExtractedText).options(undefer(ExtractedText.content)).filter(ExtractedText.id == text_id).first()
     if not text_obj:
         raise HTTPException(status_code=404, detail="❌ Text not found")
 
@@ -527,6 +1033,11 @@ def update_text(text_id: int, new_content: str, db: Session = Depends(get_db)):
     db.commit()
     db.refresh(text_obj)
 
+    # Replace the text's vectors with the new version
+    if text_obj.document and text_obj.document.user_id is not None:
+        index_text_entry(db, text_obj.document.user_id, text_obj)
+    answer_cache.invalidate_text(text_obj.id)
+
     return {
         "message": "✅ Text updated successfully.",
         "new_content": text_obj.content,
@@ -535,58 +1046,268 @@ def update_text(text_id: int, new_content: str, db: Session = Depends(get_db)):
 
 
 # -------------------- GET TEXT HISTORY --------------------
+HISTORY_FIELDS = {
+    "id": TextHistory.id,
+    "old_content": TextHistory.old_content,
+    "new_content": TextHistory.new_content,
+    "changed_at": TextHistory.changed_at,
+}
+
 @app.get("/text/{text_id}/history")
-def get_text_history(text_id: int, db: Session = Depends(get_db)):
+def get_text_history(
+    text_id: int,
+    response: Response,
+    cursor: Optional[int] = Query(None),
+    limit: int = Query(PAGE_DEFAULT_LIMIT, ge=1, le=PAGE_MAX_LIMIT),
+    fields: Optional[str] = Query(None, description="Comma-separated, e.g. id,changed_at"),
+    db: Session = Depends(get_db)
+):
     """
-    Get all previous versions of a text.
+    Get previous versions of a text, oldest first, a page at a time.
     """
-    histories = db.query(TextHistory).filter(TextHistory.text_id == text_id).all()
-    if not histories:
+    names = select_fields(fields, HISTORY_FIELDS, list(HISTORY_FIELDS))
+    stmt = keyset_page(HISTORY_FIELDS, names, [TextHistory.text_id == text_id], cursor, limit)
+    histories = db.execute(stmt).all()
+    if not histories and cursor is None:
         return {"message": "ℹ️ No history found for this text."}
-
-    return [
-        {
-            "id": h.id,
-            "old_content": h.old_content,
-            "new_content": h.new_content,
-            "changed_at": h.changed_at
-        }
-        for h in histories
-    ]
+    return page_result(histories, limit, response)
 
 # -------------------- DOCUMENT MANAGEMENT --------------------
+DOCUMENT_FIELDS = {
+    "id": Document.id,
+    "name": Document.name,
+    "type": Document.type,
+    "path": Document.path,
+    "upload_date": Document.upload_date,
+    "status": Document.status,
+    "size_bytes": Document.size_bytes,
+    "content_hash": Document.content_hash,
+}
+
 @app.get("/documents")
-def list_documents(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    docs = db.query(Document).filter(Document.user_id == current_user.id).all()
-    return [{"id": d.id, "name": d.name, "type": d.type, "path": d.path, "upload_date": d.upload_date, "status": d.status} for d in docs]
+async def list_documents(
+    response: Response,
+    cursor: Optional[int] = Query(None),
+    limit: int = Query(PAGE_DEFAULT_LIMIT, ge=1, le=PAGE_MAX_LIMIT),
+    fields: Optional[str] = Query(None, description="Comma-separated, e.g. id,name,status"),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    names = select_fields(fields, DOCUMENT_FIELDS, ["id", "name", "type", "path", "upload_date", "status"])
+    stmt = keyset_page(DOCUMENT_FIELDS, names, [Document.user_id == current_user.id], cursor, limit)
+    return page_result((await db.execute(stmt)).all(), limit, response)
+
+def page_range_filter(start_page: Optional[int], end_page: Optional[int]) -> list:
+    where = []
+    if start_page is not None:
+        where.append(ExtractedText.page_number >= start_page)
+    if end_page is not None:
+        where.append(ExtractedText.page_number <= end_page)
+    return where
 
 @app.get("/document/{doc_id}")
-def get_document(doc_id: int = Path(..., gt=0), current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    doc = db.query(Document).options(joinedload(Document.extracted_texts)).filter(Document.id == doc_id, Document.user_id == current_user.id).first()
+async def get_document(
+    doc_id: int = Path(..., gt=0),
+    include_content: bool = Query(True, description="False returns metadata only; see /document/{id}/content"),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    doc = await db.scalar(select(Document).where(Document.id == doc_id, Document.user_id == current_user.id))
     if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
-    combined_text = "\n".join([et.content for et in doc.extracted_texts])
-    return {"id": doc.id, "name": doc.name, "type": doc.type, "status": doc.status, "path": doc.path, "upload_date": doc.upload_date, "content": combined_text}
+    result = {"id": doc.id, "name": doc.name, "type": doc.type, "status": doc.status, "path": doc.path, "upload_date": doc.upload_date}
+    if include_content:
+        contents = await db.scalars(
+            select(ExtractedText.content).where(ExtractedText.document_id == doc.id)
+            .order_by(ExtractedText.page_number, ExtractedText.id)
+        )
+        result["content"] = "\n".join(contents)
+    return result
+
+@app.get("/document/{doc_id}/content")
+async def get_document_content(
+    doc_id: int = Path(..., gt=0),
+    start_page: Optional[int] = Query(None, ge=1),
+    end_page: Optional[int] = Query(None, ge=1),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Stream a document's text as plain text, page by page, optionally limited to
+    pages start_page..end_page. Pages are read from the database as they are sent.
+    """
+    doc_exists = await db.scalar(select(Document.id).where(Document.id == doc_id, Document.user_id == current_user.id))
+    if not doc_exists:
+        raise HTTPException(status_code=404, detail="Document not found")
+    stmt = (
+        select(ExtractedText.content)
+        .where(ExtractedText.document_id == doc_id, *page_range_filter(start_page, end_page))
+        .order_by(ExtractedText.page_number, ExtractedText.id)
+        .execution_options(yield_per=20)
+    )
+
+    async def page_stream():
+        # The request's session is closed once streaming starts, so read with a fresh one
+        async with AsyncSessionLocal() as stream_db:
+            first = True
+            async for content in await stream_db.stream_scalars(stmt):
+                yield ("" if first else "\n") + (content or "")
+                first = False
+
+    return StreamingResponse(page_stream(), media_type="text/plain; charset=utf-8")
+
+@app.get("/document/{doc_id}/status")
+def get_document_status(doc_id: int = Path(..., gt=0), current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    doc = db.query(Document).filter(Document.id == doc_id, Document.user_id == current_user.id).first()
+    if not doc:
+        raise HTTPException(status_code=404, detail="Document not found")
+    job = get_job(doc.id) or {}
+    return {
+        "document_id": doc.id,
+        "status": doc.status,
+        "stage": job.get("stage", "done" if doc.status != "pending" else "queued"),
+        "progress": job.get("progress", 1.0 if doc.status == "processed" else 0.0),
+        "error": job.get("error")
+    }
 
 @app.delete("/document/{doc_id}")
 def delete_document(doc_id: int = Path(..., gt=0), current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     doc = db.query(Document).filter(Document.id == doc_id, Document.user_id == current_user.id).first()
     if not doc:
         raise HTTPException(404, "Document not found")
-    if doc.path != "N/A" and doc.path and os.path.exists(doc.path):
-        os.remove(doc.path)
+    path, content_hash = doc.path, doc.content_hash
     db.delete(doc)
     db.commit()
+    # Uploads are stored by content hash: only remove the file once no document references it
+    # (looked up through the content_hash index; older uploads without one by path)
+    if path != "N/A" and path:
+        refs = db.query(Document.id).filter(Document.path == path)
+        if content_hash:
+            refs = refs.filter(Document.content_hash == content_hash)
+        with blob_lock():
+            if not refs.first() and os.path.exists(path):
+                os.remove(path)
+    unindex_document(current_user.id, doc_id)
+    answer_cache.invalidate_document(doc_id)
     return {"message": "Document deleted successfully"}
 
+# Name / id matches first (with their best page, if any), then BM25-ranked text
+# hits of the other documents, paginated as one list so no result falls between
+# two pages. Snippets are only built for the rows of the page (FTS_SNIPPET_SQL):
+# snippet() over every hit costs far more than ranking them.
+FTS_SEARCH_SQL = sql_text("""
+    WITH named AS (
+        SELECT id FROM documents
+        WHERE user_id = :user_id AND (name LIKE :name_pattern OR id = :doc_id)
+    ), hits AS (
+        SELECT extracted_text_fts.rowid AS text_id, et.document_id, et.page_number,
+               bm25(extracted_text_fts) AS rank
+        FROM extracted_text_fts
+        JOIN extracted_text et ON et.id = extracted_text_fts.rowid
+        JOIN documents d ON d.id = et.document_id
+        WHERE extracted_text_fts MATCH :match AND d.user_id = :user_id
+    ), best AS (
+        SELECT hits.*, ROW_NUMBER() OVER (PARTITION BY document_id ORDER BY rank) AS rn FROM hits
+    ), ranked AS (
+        SELECT named.id AS document_id, best.text_id, best.page_number, best.rank, 0 AS grp
+        FROM named LEFT JOIN best ON best.document_id = named.id AND best.rn = 1
+        UNION ALL
+        SELECT document_id, text_id, page_number, rank, 1 AS grp FROM best
+        WHERE rn = 1 AND document_id NOT IN (SELECT id FROM named)
+    )
+    SELECT d.id, d.name, d.type, d.upload_date, d.status, ranked.text_id, ranked.page_number, ranked.rank
+    FROM ranked JOIN documents d ON d.id = ranked.document_id
+    ORDER BY ranked.grp, ranked.rank IS NULL, ranked.rank, d.id
+    LIMIT :limit OFFSET :offset
+""")
+
+FTS_SNIPPET_SQL = sql_text("""
+    SELECT rowid, snippet(extracted_text_fts, 0, '<mark>', '</mark>', '…', 32) AS snippet
+    FROM extracted_text_fts
+    WHERE extracted_text_fts MATCH :match AND rowid IN :text_ids
+""").bindparams(bindparam("text_ids", expanding=True))
+
+def fts_match_expression(query: str) -> str:
+    # Every word must match, as a prefix ("mach lear" finds "machine learning")
+    terms = re.findall(r"\w+", query)
+    return " ".join(f'"{t}"*' for t in terms)
+
 @app.get("/search")
-def search_documents(query: str = Query(...), current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    results = db.query(Document).join(ExtractedText).filter(
-        Document.user_id == current_user.id,
-        (Document.name.ilike(f"%{query}%")) |
-        (ExtractedText.content.ilike(f"%{query}%")) |
-        (Document.id == query if query.isdigit() else False)
-    ).all()
+async def search_documents(
+    query: str = Query(...),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    if not FTS_ENABLED:
+        return await search_documents_like(query, limit, offset, current_user, db)
+
+    doc_id = int(query) if query.isdigit() else None
+    match = fts_match_expression(query)
+    if not match:
+        # Nothing for FTS to match on: name / id matches only
+        name_filter = Document.name.ilike(f"%{query}%")
+        if doc_id is not None:
+            name_filter = name_filter | (Document.id == doc_id)
+        docs = await db.scalars(
+            select(Document).where(Document.user_id == current_user.id, name_filter)
+            .order_by(Document.id).limit(limit).offset(offset)
+        )
+        return [
+            {
+                "document_id": doc.id,
+                "name": doc.name,
+                "type": doc.type,
+                "upload_date": doc.upload_date,
+                "status": doc.status,
+                "page_number": None,
+                "snippet": ""
+            }
+            for doc in docs
+        ]
+
+    rows = (await db.execute(FTS_SEARCH_SQL, {
+        "match": match, "user_id": current_user.id, "name_pattern": f"%{query}%", "doc_id": doc_id,
+        "limit": limit, "offset": offset
+    })).all()
+    text_ids = [row.text_id for row in rows if row.text_id is not None]
+    snippets = dict((await db.execute(FTS_SNIPPET_SQL, {"match": match, "text_ids": text_ids})).all()) if text_ids else {}
+    results = []
+    for row in rows:
+        result = {
+            "document_id": row.id,
+            "name": row.name,
+            "type": row.type,
+            "upload_date": row.upload_date,
+            "status": row.status,
+            "page_number": row.page_number,
+            "snippet": snippets.get(row.text_id, "")
+        }
+        if row.rank is not None:
+            result["score"] = -row.rank  # bm25() is lower-is-better
+        results.append(result)
+    return results
+
+async def search_documents_like(query: str, limit: int, offset: int, current_user: User, db: AsyncSession):
+    """
+    Substring search for databases without FTS5.
+    """
+    results = (await db.scalars(
+        select(Document).join(ExtractedText).where(
+            Document.user_id == current_user.id,
+            (Document.name.ilike(f"%{query}%")) |
+            (ExtractedText.content.ilike(f"%{query}%")) |
+            (Document.id == query if query.isdigit() else False)
+        ).distinct().order_by(Document.id).limit(limit).offset(offset)
+    )).all()
+    # First matching chunk of every result in one query (instead of loading all their texts)
+    snippets = {}
+    if results:
+        rows = await db.execute(first_chunks_query(
+            [doc.id for doc in results], per_document=1, length=200, where=ExtractedText.content.ilike(f"%{query}%")
+        ))
+        snippets = group_snippets(rows.all())
     return [
         {
             "document_id": doc.id,
@@ -594,11 +1315,24 @@ def search_documents(query: str = Query(...), current_user: User = Depends(get_c
             "type": doc.type,
             "upload_date": doc.upload_date,
             "status": doc.status,
-            "snippet": next((text.content[:200] for text in doc.extracted_texts if query.lower() in text.content.lower()), "")
+            "snippet": snippets.get(doc.id, [""])[0]
         }
         for doc in results
     ]
 
+@app.on_event("startup")
+def resume_ingest_jobs():
+    # Uploads a previous process accepted but never finished would otherwise stay "pending"
+    if INGEST_RESUME:
+        resume_pending_jobs()
+
+@app.on_event("shutdown")
+async def stop_background_clients():
+    shutdown_ingest()
+    await llm.aclose()
+    await close_providers()
+    await close_wikipedia_client()
+
 # -------------------- CATCH-ALL FRONTEND ROUTE --------------------
 @app.get("/{full_path:path}")
 def serve_frontend(full_path: str = ""):
@@ -0,0 +1,123 @@
+"""Baseline schema
+
+Creates every table on an empty database. Databases created before migrations
+existed (by create_all plus add_column_if_missing) are adopted as they are:
+existing tables only get the columns and indexes they are missing.
+
+Revision ID: 0001_baseline
+Revises:
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001_baseline"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def tables():
+    # Order matters: tables come after the ones they reference
+    return [
+        ("users", [
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("email", sa.String, nullable=False),
+            sa.Column("otp", sa.String, nullable=True),
+            sa.Column("password", sa.String, nullable=True),
+            sa.Column("verified", sa.Boolean, nullable=True),
+        ]),
+        ("documents", [
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("name", sa.String),
+            sa.Column("type", sa.String),
+            sa.Column("path", sa.String),
+            sa.Column("upload_date", sa.DateTime),
+            sa.Column("status", sa.String),
+            sa.Column("age", sa.Integer, nullable=True),
+            sa.Column("city", sa.String, nullable=True),
+            sa.Column("content_hash", sa.String(64), nullable=True),
+            sa.Column("size_bytes", sa.Integer, nullable=True),
+            sa.Column("user_id", sa.Integer, sa.ForeignKey("users.id"), nullable=True),
+        ]),
+        ("extracted_text", [
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("document_id", sa.Integer, sa.ForeignKey("documents.id")),
+            sa.Column("content", sa.Text),
+            sa.Column("page_number", sa.Integer, nullable=True),
+            sa.Column("version", sa.Integer),
+        ]),
+        ("text_history", [
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("text_id", sa.Integer, sa.ForeignKey("extracted_text.id")),
+            sa.Column("old_content", sa.Text),
+            sa.Column("new_content", sa.Text),
+            sa.Column("changed_at", sa.DateTime),
+        ]),
+        ("conversation_sessions", [
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("user_id", sa.Integer, sa.ForeignKey("users.id")),
+            sa.Column("title", sa.String, nullable=True),
+            sa.Column("summary", sa.Text),
+            sa.Column("summarized_turns", sa.Integer),
+            sa.Column("turn_count", sa.Integer),
+            sa.Column("context_chunk_ids", sa.Text),
+            sa.Column("created_at", sa.DateTime),
+            sa.Column("updated_at", sa.DateTime),
+        ]),
+        ("questions", [
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("question_text", sa.Text),
+            sa.Column("answer_text", sa.Text),
+            sa.Column("created_at", sa.DateTime),
+            sa.Column("user_id", sa.Integer, sa.ForeignKey("users.id"), nullable=True),
+            sa.Column("session_id", sa.Integer, sa.ForeignKey("conversation_sessions.id"), nullable=True),
+        ]),
+        ("question_sources", [
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("question_id", sa.Integer, sa.ForeignKey("questions.id")),
+            sa.Column("document_id", sa.Integer, sa.ForeignKey("documents.id")),
+            sa.Column("relevance_score", sa.Float, nullable=True),
+        ]),
+    ]
+
+
+INDEXES = [
+    # (name, table, columns, unique)
+    ("ix_users_id", "users", ["id"], False),
+    ("ix_users_email", "users", ["email"], True),
+    ("ix_documents_id", "documents", ["id"], False),
+    ("ix_documents_content_hash", "documents", ["content_hash"], False),
+    ("ix_extracted_text_id", "extracted_text", ["id"], False),
+    ("ix_text_history_id", "text_history", ["id"], False),
+    ("ix_conversation_sessions_id", "conversation_sessions", ["id"], False),
+    ("ix_conversation_sessions_user_id", "conversation_sessions", ["user_id"], False),
+    ("ix_questions_id", "questions", ["id"], False),
+    ("ix_questions_user_session_created", "questions", ["user_id", "session_id", "created_at"], False),
+]
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    existing = set(inspector.get_table_names())
+
+    for name, columns in tables():
+        if name not in existing:
+            op.create_table(name, *columns)
+            continue
+        # Columns added over time (formerly add_column_if_missing); added without
+        # constraints, as before, since SQLite can't add a foreign key in place
+        present = {c["name"] for c in inspector.get_columns(name)}
+        for column in columns:
+            if column.name not in present:
+                op.add_column(name, sa.Column(column.name, column.type, nullable=True))
+
+    inspector = sa.inspect(op.get_bind())
+    for name, table, columns, unique in INDEXES:
+        if name not in {i["name"] for i in inspector.get_indexes(table)}:
+            op.create_index(name, table, columns, unique=unique)
+
+
+def downgrade():
+    for name, _ in reversed(tables()):
+        op.drop_table(name)
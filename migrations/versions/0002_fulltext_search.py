@@ -0,0 +1,51 @@
+"""Full-text search over extracted_text (SQLite FTS5)
+
+An external-content FTS5 table kept in sync by triggers. Existing rows are
+indexed once. Other backends have no FTS table; /search falls back to ILIKE.
+
+Revision ID: 0002_fulltext_search
+Revises: 0001_baseline
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002_fulltext_search"
+down_revision = "0001_baseline"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != "sqlite":
+        return
+    exists = bind.execute(sa.text("SELECT 1 FROM sqlite_master WHERE name = 'extracted_text_fts'")).first()
+    op.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS extracted_text_fts USING fts5("
+        "content, content='extracted_text', content_rowid='id', tokenize='porter unicode61')"
+    )
+    op.execute(
+        "CREATE TRIGGER IF NOT EXISTS extracted_text_fts_ai AFTER INSERT ON extracted_text BEGIN "
+        "INSERT INTO extracted_text_fts(rowid, content) VALUES (new.id, new.content); END"
+    )
+    op.execute(
+        "CREATE TRIGGER IF NOT EXISTS extracted_text_fts_ad AFTER DELETE ON extracted_text BEGIN "
+        "INSERT INTO extracted_text_fts(extracted_text_fts, rowid, content) VALUES ('delete', old.id, old.content); END"
+    )
+    op.execute(
+        "CREATE TRIGGER IF NOT EXISTS extracted_text_fts_au AFTER UPDATE OF content ON extracted_text BEGIN "
+        "INSERT INTO extracted_text_fts(extracted_text_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+        "INSERT INTO extracted_text_fts(rowid, content) VALUES (new.id, new.content); END"
+    )
+    if not exists:
+        op.execute("INSERT INTO extracted_text_fts(extracted_text_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != "sqlite":
+        return
+    for trigger in ("extracted_text_fts_ai", "extracted_text_fts_ad", "extracted_text_fts_au"):
+        op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    op.execute("DROP TABLE IF EXISTS extracted_text_fts")
@@ -0,0 +1,32 @@
+"""Composite indexes for per-user, per-document, per-question and per-text lookups
+
+Revision ID: 0003_lookup_indexes
+Revises: 0002_fulltext_search
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003_lookup_indexes"
+down_revision = "0002_fulltext_search"
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ("ix_documents_user_id_id", "documents", ["user_id", "id"]),
+    ("ix_extracted_text_document_page", "extracted_text", ["document_id", "page_number", "id"]),
+    ("ix_question_sources_question_document", "question_sources", ["question_id", "document_id"]),
+    ("ix_text_history_text_changed", "text_history", ["text_id", "changed_at"]),
+]
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    for name, table, columns in INDEXES:
+        if name not in {i["name"] for i in inspector.get_indexes(table)}:
+            op.create_index(name, table, columns)
+
+
+def downgrade():
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
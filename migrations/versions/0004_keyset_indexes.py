@@ -0,0 +1,36 @@
+"""Indexes matching the keyset pagination of /saved and /text/{id}/history
+
+Both pages are read as WHERE <owner> = ? AND id > ? ORDER BY id. History
+pages order by id, so its (text_id, changed_at) index is replaced.
+
+Revision ID: 0004_keyset_indexes
+Revises: 0003_lookup_indexes
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004_keyset_indexes"
+down_revision = "0003_lookup_indexes"
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ("ix_questions_user_id_id", "questions", ["user_id", "id"]),
+    ("ix_text_history_text_id_id", "text_history", ["text_id", "id"]),
+]
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if "ix_text_history_text_changed" in {i["name"] for i in inspector.get_indexes("text_history")}:
+        op.drop_index("ix_text_history_text_changed", table_name="text_history")
+    for name, table, columns in INDEXES:
+        if name not in {i["name"] for i in inspector.get_indexes(table)}:
+            op.create_index(name, table, columns)
+
+
+def downgrade():
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
+    op.create_index("ix_text_history_text_changed", "text_history", ["text_id", "changed_at"])
@@ -0,0 +1,33 @@
+"""
+Common interface for external knowledge sources used to answer or enrich /ask.
+"""
+
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import List, Optional
+
+
+@dataclass
+class SourceResult:
+    title: str
+    text: str
+    provider: str
+    score: float = 1.0          # provider-specific relevance, higher is better
+    url: Optional[str] = None
+
+
+class SourceProvider(ABC):
+    """
+    A provider returns up to `limit` results for a query. Providers may be
+    slow or fail; the fan-out in open_sources.registry enforces the deadline.
+    """
+
+    name = "base"
+    weight = 1.0  # multiplier applied to the provider's normalized scores when merging
+
+    @abstractmethod
+    async def search(self, query: str, limit: int = 3) -> List[SourceResult]:
+        ...
+
+    async def aclose(self):
+        pass
@@ -0,0 +1,108 @@
+"""
+Built-in knowledge-source providers: Wikipedia, a local offline dump and a
+generic JSON-over-HTTP source.
+"""
+
+import os
+import json
+import asyncio
+import threading
+import httpx
+from typing import List, Optional
+from embeded_store import BM25Index
+from open_sources.base import SourceProvider, SourceResult
+from open_sources.wikipedia_client import wikipedia_summary_for
+
+
+class WikipediaProvider(SourceProvider):
+    name = "wikipedia"
+
+    async def search(self, query: str, limit: int = 3) -> List[SourceResult]:
+        wiki = await wikipedia_summary_for(query)
+        if not wiki:
+            return []
+        title, summary = wiki
+        return [SourceResult(
+            title=title,
+            text=summary,
+            provider=self.name,
+            url=f"https://en.wikipedia.org/wiki/{title.replace(' ', '_')}",
+        )]
+
+
+class LocalDumpProvider(SourceProvider):
+    """
+    Offline articles from *.jsonl files in a folder, one {"title", "text", "url"?}
+    object per line, searched with BM25. The folder is read on first search.
+    """
+
+    name = "local"
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.articles: List[dict] = []
+        self.index: Optional[BM25Index] = None
+        self._load_lock = threading.Lock()
+
+    def _load(self):
+        with self._load_lock:
+            if self.index is not None:
+                return
+            index = BM25Index()
+            for filename in sorted(os.listdir(self.folder)):
+                if not filename.endswith(".jsonl"):
+                    continue
+                with open(os.path.join(self.folder, filename), "r", encoding="utf-8") as f:
+                    for line in f:
+                        if not line.strip():
+                            continue
+                        article = json.loads(line)
+                        index.add(len(self.articles), f"{article.get('title', '')} {article.get('text', '')}")
+                        self.articles.append(article)
+            self.index = index
+
+    def _search(self, query: str, limit: int) -> List[SourceResult]:
+        self._load()
+        return [
+            SourceResult(
+                title=self.articles[i].get("title", ""),
+                text=self.articles[i].get("text", "")[:1200],
+                provider=self.name,
+                score=score,
+                url=self.articles[i].get("url"),
+            )
+            for i, score in self.index.search(query, limit)
+        ]
+
+    async def search(self, query: str, limit: int = 3) -> List[SourceResult]:
+        return await asyncio.to_thread(self._search, query, limit)
+
+
+class HTTPSourceProvider(SourceProvider):
+    """
+    Custom source answering GET <url>?q=<query>&limit=<n> with a JSON list of
+    {"title", "text", "url"?, "score"?} objects.
+    """
+
+    def __init__(self, url: str, name: str = "http", timeout: float = 3.0):
+        self.url = url
+        self.name = name
+        self._client = httpx.AsyncClient(timeout=timeout, headers={"accept": "application/json"})
+
+    async def search(self, query: str, limit: int = 3) -> List[SourceResult]:
+        r = await self._client.get(self.url, params={"q": query, "limit": limit})
+        r.raise_for_status()
+        return [
+            SourceResult(
+                title=item.get("title", ""),
+                text=(item.get("text") or "")[:1200],
+                provider=self.name,
+                score=float(item.get("score", 1.0)),
+                url=item.get("url"),
+            )
+            for item in r.json()[:limit]
+            if item.get("text")
+        ]
+
+    async def aclose(self):
+        await self._client.aclose()
@@ -0,0 +1,110 @@
+"""
+Concurrent fan-out over the configured knowledge-source providers.
+
+Providers are queried in parallel under one global deadline; anything not
+finished by then is cancelled, so one slow provider never delays the answer.
+Results are merged by per-provider normalized score, and each provider's
+latency, errors and timeouts are recorded.
+"""
+
+import os
+import time
+import asyncio
+from typing import Dict, List, Optional
+from open_sources.base import SourceProvider, SourceResult
+from open_sources.providers import WikipediaProvider, LocalDumpProvider, HTTPSourceProvider
+
+# Comma-separated providers to use: wikipedia, local, http
+OPEN_SOURCES = os.getenv("OPEN_SOURCES", "wikipedia")
+OPEN_SOURCES_LOCAL_DIR = os.getenv("OPEN_SOURCES_LOCAL_DIR", "open_sources/data")
+OPEN_SOURCES_HTTP_URL = os.getenv("OPEN_SOURCES_HTTP_URL", "")
+OPEN_SOURCES_DEADLINE = float(os.getenv("OPEN_SOURCES_DEADLINE", "2.5"))  # seconds for the whole fan-out
+
+_providers: Optional[List[SourceProvider]] = None
+provider_stats: Dict[str, dict] = {}
+
+
+def get_providers() -> List[SourceProvider]:
+    global _providers
+    if _providers is None:
+        providers = []
+        for name in (n.strip() for n in OPEN_SOURCES.split(",")):
+            if name == "wikipedia":
+                providers.append(WikipediaProvider())
+            elif name == "local" and os.path.isdir(OPEN_SOURCES_LOCAL_DIR):
+                providers.append(LocalDumpProvider(OPEN_SOURCES_LOCAL_DIR))
+            elif name == "http" and OPEN_SOURCES_HTTP_URL:
+                providers.append(HTTPSourceProvider(OPEN_SOURCES_HTTP_URL))
+        _providers = providers
+    return _providers
+
+
+def _record(name: str, started: float, outcome: str):
+    stats = provider_stats.setdefault(name, {"calls": 0, "errors": 0, "timeouts": 0, "total_ms": 0.0, "last_ms": 0.0})
+    elapsed = (time.perf_counter() - started) * 1000
+    stats["calls"] += 1
+    stats["total_ms"] += elapsed
+    stats["last_ms"] = round(elapsed, 1)
+    if outcome == "error":
+        stats["errors"] += 1
+    elif outcome == "timeout":
+        stats["timeouts"] += 1
+
+
+def merge_results(results: List[List[SourceResult]], limit: int) -> List[SourceResult]:
+    """
+    Normalize scores within each provider, weight them, drop duplicate titles and keep the best `limit`.
+    """
+    weights = {p.name: p.weight for p in get_providers()}
+    scored = []
+    for provider_results in results:
+        if not provider_results:
+            continue
+        top = max(r.score for r in provider_results) or 1.0
+        for r in provider_results:
+            scored.append((weights.get(r.provider, 1.0) * r.score / top, r))
+    scored.sort(key=lambda item: item[0], reverse=True)
+
+    merged, seen = [], set()
+    for score, r in scored:
+        key = r.title.strip().lower()
+        if key in seen:
+            continue
+        seen.add(key)
+        r.score = round(score, 4)
+        merged.append(r)
+    return merged[:limit]
+
+
+async def gather_sources(query: str, limit: int = 3, deadline: float = OPEN_SOURCES_DEADLINE) -> List[SourceResult]:
+    providers = get_providers()
+    if not providers:
+        return []
+    started = time.perf_counter()
+    tasks = {asyncio.create_task(p.search(query, limit)): p for p in providers}
+    done, pending = await asyncio.wait(tasks, timeout=deadline)
+    for task in pending:
+        task.cancel()
+        _record(tasks[task].name, started, "timeout")
+
+    results = []
+    for task in done:
+        name = tasks[task].name
+        if task.exception() is not None:
+            _record(name, started, "error")
+            continue
+        _record(name, started, "ok")
+        results.append(task.result())
+    return merge_results(results, limit)
+
+
+def get_provider_stats() -> Dict[str, dict]:
+    return {
+        name: dict(stats, avg_ms=round(stats["total_ms"] / stats["calls"], 1) if stats["calls"] else 0)
+        for name, stats in provider_stats.items()
+    }
+
+
+async def close_providers():
+    for provider in get_providers():
+        await provider.aclose()
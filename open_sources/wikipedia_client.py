@@ -1,17 +1,133 @@
 """
-Lightweight Wikipedia client using public REST APIs (no extra dependencies).
+Lightweight async Wikipedia client using public REST APIs.
+
+All requests share one keep-alive httpx.AsyncClient. search→title and
+title→summary lookups are cached with a TTL in a small SQLite file shared by
+all workers (read and written off the event loop), fronted by a bounded
+in-memory LRU; misses are cached too (for a shorter time) so unknown topics
+don't hit the network on every question. Set WIKI_BASE_URL to point the client
+at a local stub server.
 """
 
-import requests
+import os
+import json
+import asyncio
+import time
+import sqlite3
+import threading
+import httpx
+from collections import OrderedDict
 from typing import Optional, Tuple
 
-WIKI_API = "https://en.wikipedia.org/w/api.php"
-WIKI_SUMMARY = "https://en.wikipedia.org/api/rest_v1/page/summary/{title}"
+WIKI_TIMEOUT = float(os.getenv("WIKI_TIMEOUT", "3"))          # seconds per request
+WIKI_CACHE_TTL = int(os.getenv("WIKI_CACHE_TTL", str(24 * 3600)))
+WIKI_NEGATIVE_TTL = int(os.getenv("WIKI_NEGATIVE_TTL", "3600"))
+WIKI_CACHE_FILE = os.getenv("WIKI_CACHE_FILE", "wiki_cache.db")
+WIKI_MEMORY_CACHE_SIZE = int(os.getenv("WIKI_MEMORY_CACHE_SIZE", "2000"))  # entries kept in memory
+WIKI_CACHE_PURGE_EVERY = 500  # delete expired rows from the file after this many writes
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Key → JSON value cache with expiry, stored in SQLite with the most recently
+    used max_entries kept in memory. A cached None is a remembered miss.
+    """
+
+    def __init__(self, path: str, max_entries: int = WIKI_MEMORY_CACHE_SIZE):
+        self.path = path
+        self.max_entries = max_entries
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._memory_lock = threading.Lock()
+        self._local = threading.local()
+        self._writes = 0
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, expires REAL NOT NULL)")
+        self._purge()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _remember(self, key: str, entry: tuple):
+        with self._memory_lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    # ---------- SQLite (blocking; run in a worker thread) ----------
+    def _read(self, key: str):
+        return self._connect().execute("SELECT value, expires FROM cache WHERE key = ?", (key,)).fetchone()
+
+    def _write(self, key: str, value, expires: float):
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+                         (key, json.dumps(value), expires))
+        self._writes += 1
+        if self._writes % WIKI_CACHE_PURGE_EVERY == 0:
+            self._purge()
+
+    def _purge(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM cache WHERE expires < ?", (time.time(),))
+
+    # ---------- async API ----------
+    async def get(self, key: str):
+        now = time.time()
+        with self._memory_lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+        if entry is None:
+            row = await asyncio.to_thread(self._read, key)
+            if row is None:
+                return _MISSING
+            entry = (json.loads(row[0]), row[1])
+            if entry[1] >= now:
+                self._remember(key, entry)
+        value, expires = entry
+        if expires < now:
+            with self._memory_lock:
+                self._memory.pop(key, None)
+            return _MISSING
+        return value
 
-def search_title(query: str) -> Optional[str]:
+    async def set(self, key: str, value, ttl: int):
+        expires = time.time() + ttl
+        self._remember(key, (value, expires))
+        await asyncio.to_thread(self._write, key, value, expires)
+
+
+_cache = TTLCache(WIKI_CACHE_FILE)
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            base_url=os.getenv("WIKI_BASE_URL", "https://en.wikipedia.org"),  # read here, so it can be set after import
+            timeout=httpx.Timeout(WIKI_TIMEOUT, connect=2.0),
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+            headers={"accept": "application/json", "user-agent": "fastapi-qna/1.0"},
+        )
+    return _client
+
+
+async def search_title(query: str) -> Optional[str]:
     """
     Return the best-matching Wikipedia page title for a query using opensearch.
     """
+    key = f"title:{query.strip().lower()}"
+    cached = await _cache.get(key)
+    if cached is not _MISSING:
+        return cached
     try:
         params = {
             "action": "opensearch",
@@ -20,42 +136,57 @@ def search_title(query: str) -> Optional[str]:
             "namespace": 0,
             "format": "json"
         }
-        r = requests.get(WIKI_API, params=params, timeout=10)
+        r = await get_client().get("/w/api.php", params=params)
         r.raise_for_status()
         data = r.json()
-        if isinstance(data, list) and len(data) >= 2 and data[1]:
-            return data[1][0]
     except Exception:
-        return None
-    return None
+        return None  # network errors are not cached
+    title = data[1][0] if isinstance(data, list) and len(data) >= 2 and data[1] else None
+    await _cache.set(key, title, WIKI_CACHE_TTL if title else WIKI_NEGATIVE_TTL)
+    return title
 
-def fetch_summary(title: str) -> Optional[str]:
+
+async def fetch_summary(title: str) -> Optional[str]:
     """
     Fetch the plain-text summary for a given title (first paragraph or two).
     """
+    key = f"summary:{title}"
+    cached = await _cache.get(key)
+    if cached is not _MISSING:
+        return cached
     try:
-        url = WIKI_SUMMARY.format(title=title.replace(" ", "_"))
-        r = requests.get(url, timeout=10, headers={"accept": "application/json"})
-        r.raise_for_status()
-        data = r.json()
-        # 'extract' has the text summary
-        extract = data.get("extract")
-        if extract:
-            # Clamp to ~1200 chars to keep prompt light
-            return extract[:1200]
+        url = f"/api/rest_v1/page/summary/{title.replace(' ', '_')}"
+        r = await get_client().get(url)
+        if r.status_code == 404:
+            data = {}
+        else:
+            r.raise_for_status()
+            data = r.json()
     except Exception:
         return None
-    return None
+    # 'extract' has the text summary; clamp to ~1200 chars to keep prompt light
+    extract = data.get("extract")
+    summary = extract[:1200] if extract else None
+    await _cache.set(key, summary, WIKI_CACHE_TTL if summary else WIKI_NEGATIVE_TTL)
+    return summary
 
-def wikipedia_summary_for(query: str) -> Optional[Tuple[str, str]]:
+
+async def wikipedia_summary_for(query: str) -> Optional[Tuple[str, str]]:
     """
     High-level helper: search a title then fetch its summary.
     Returns (title, summary) or None if not found.
     """
-    title = search_title(query)
+    title = await search_title(query)
     if not title:
         return None
-    summary = fetch_summary(title)
+    summary = await fetch_summary(title)
     if not summary:
         return None
     return title, summary
+
+
+async def aclose():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -0,0 +1,120 @@
+"""
+Prompt assembly under a token budget.
+
+Tokens are counted locally with tiktoken (falling back to a word-based
+estimate if no encoding can be loaded). Retrieved chunks are added in
+relevance order while they fit the budget; chunks that are near-duplicates of
+one already added are skipped, and long chunks can optionally be compressed
+to the sentences that share the most terms with the question.
+"""
+
+import os
+import re
+import threading
+from typing import List, Set, Tuple
+import tiktoken
+from embeded_store import tokenize
+from llm_client import LLM_MODEL
+
+# Model context window; the context budget is clamped so the prompt and answer always fit
+LLM_CONTEXT_WINDOW = int(os.getenv("LLM_CONTEXT_WINDOW", "8192"))
+ANSWER_TOKENS = 500  # max_tokens requested for the answer
+# Chunks whose word shingles overlap an earlier chunk's by at least this much are dropped
+DEDUP_THRESHOLD = float(os.getenv("PROMPT_DEDUP_THRESHOLD", "0.8"))
+SHINGLE_SIZE = 5
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+def _get_encoding():
+    global _encoding
+    with _encoding_lock:
+        if _encoding is None:
+            try:
+                try:
+                    _encoding = tiktoken.encoding_for_model(LLM_MODEL)
+                except KeyError:  # model tiktoken doesn't know
+                    _encoding = tiktoken.get_encoding("cl100k_base")
+            except Exception:
+                _encoding = False  # encoding files unavailable (offline) → estimate
+        return _encoding
+
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    # Rough estimate: ~1.3 model tokens per whitespace-separated word
+    return int(len(text.split()) * 1.3) + 1
+
+def context_budget(requested: int, *fixed_texts: str) -> int:
+    """
+    Tokens available for context: the requested budget, clamped to what is left of
+    the context window after the fixed prompt parts and the answer.
+    """
+    fixed = sum(count_tokens(t) for t in fixed_texts)
+    return max(0, min(requested, LLM_CONTEXT_WINDOW - ANSWER_TOKENS - fixed))
+
+# -------------------- DEDUPLICATION --------------------
+def shingles(text: str) -> Set[tuple]:
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= SHINGLE_SIZE:
+        return {tuple(words)}
+    return {tuple(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+def jaccard(a: Set[tuple], b: Set[tuple]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+# -------------------- COMPRESSION --------------------
+SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+|\n+")
+
+def compress_text(text: str, question: str, max_tokens: int) -> str:
+    """
+    Keep the sentences sharing the most terms with the question, in their
+    original order, until max_tokens is reached.
+    """
+    sentences = [s.strip() for s in SENTENCE_SPLIT.split(text) if s.strip()]
+    if len(sentences) <= 1:
+        return text
+    terms = set(tokenize(question))
+    ranked = sorted(
+        range(len(sentences)),
+        key=lambda i: len(terms & set(tokenize(sentences[i]))),
+        reverse=True,
+    )
+    keep, total = [], 0
+    for i in ranked:
+        tokens = count_tokens(sentences[i])
+        if total + tokens > max_tokens:
+            continue
+        keep.append(i)
+        total += tokens
+    return " ".join(sentences[i] for i in sorted(keep)) if keep else text
+
+# -------------------- CONTEXT --------------------
+def build_context(chunks: List[dict], question: str, token_budget: int,
+                  compress_over: int = 0) -> Tuple[str, List[dict], int]:
+    """
+    Take chunks in relevance order until the token budget is used up, skipping
+    near-duplicates. If compress_over > 0, chunks longer than that many tokens
+    are cut down to their most question-relevant sentences first.
+    Returns (context_text, used_chunks, tokens_used).
+    """
+    used, parts, seen, total = [], [], [], 0
+    for chunk in chunks:
+        text = chunk["text"]
+        signature = shingles(text)
+        if any(jaccard(signature, other) >= DEDUP_THRESHOLD for other in seen):
+            continue
+        tokens = count_tokens(text)
+        if compress_over and tokens > compress_over:
+            text = compress_text(text, question, compress_over)
+            tokens = count_tokens(text)
+        if total + tokens > token_budget:
+            continue
+        parts.append(text)
+        used.append(chunk)
+        seen.append(signature)
+        total += tokens
+    return "\n\n".join(parts), used, total
@@ -0,0 +1,122 @@
+"""
+Hybrid retrieval: run the BM25 and FAISS searches of a user's store in
+parallel and merge them with reciprocal-rank fusion (RRF), then optionally
+rerank the best candidates with a local cross-encoder.
+"""
+
+import os
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+from typing import Dict, List, Optional
+from sentence_transformers import CrossEncoder
+from embeded_store import VectorStore
+
+# RRF constant: score = sum(1 / (RRF_K + rank)) over the retrievers that found a chunk
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Each retriever returns this many candidates per requested result
+CANDIDATE_MULTIPLIER = 4
+
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+# Cross-encoder calls scored at once; requests arriving while all are busy skip reranking
+RERANK_WORKERS = int(os.getenv("RERANK_WORKERS", "1"))
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv("RETRIEVAL_WORKERS", "8")), thread_name_prefix="retrieval")
+# Separate pool, so slow scoring (or the model download) never holds up first-stage retrieval
+_rerank_executor = ThreadPoolExecutor(max_workers=RERANK_WORKERS, thread_name_prefix="rerank")
+
+def reciprocal_rank_fusion(result_lists: Dict[str, List[dict]], k: int = RRF_K) -> List[dict]:
+    """
+    Merge ranked chunk lists by id. Each fused chunk keeps its per-retriever
+    rank and score (e.g. "vector_rank", "lexical_score"); "score" is the RRF score.
+    """
+    fused: Dict[int, dict] = {}
+    for name, results in result_lists.items():
+        for rank, chunk in enumerate(results, 1):
+            entry = fused.setdefault(chunk["id"], dict(chunk, score=0.0))
+            entry["score"] += 1.0 / (k + rank)
+            entry[f"{name}_rank"] = rank
+            entry[f"{name}_score"] = chunk["score"]
+    return sorted(fused.values(), key=lambda c: c["score"], reverse=True)
+
+def hybrid_search(store: VectorStore, query: str, top_k: int = 5) -> List[dict]:
+    """
+    Top_k chunks for a query by fused BM25 + vector rank.
+    """
+    n = top_k * CANDIDATE_MULTIPLIER
+    vector = _executor.submit(store.search, query, n)
+    lexical = _executor.submit(store.lexical_search, query, n)
+    fused = reciprocal_rank_fusion({"vector": vector.result(), "lexical": lexical.result()})
+    return fused[:top_k]
+
+def hybrid_search_many(store: VectorStore, queries: List[str], top_k: int = 5) -> List[List[dict]]:
+    """
+    hybrid_search() for several queries: one batched vector search, BM25 per query in parallel.
+    """
+    n = top_k * CANDIDATE_MULTIPLIER
+    vector = _executor.submit(store.search_many, queries, n)
+    lexical = [_executor.submit(store.lexical_search, q, n) for q in queries]
+    return [
+        reciprocal_rank_fusion({"vector": v, "lexical": l.result()})[:top_k]
+        for v, l in zip(vector.result(), lexical)
+    ]
+
+
+# -------------------- CROSS-ENCODER RERANKING --------------------
+_model_future: Optional[Future] = None
+_model_lock = threading.Lock()
+_rerank_slots = threading.BoundedSemaphore(RERANK_WORKERS)
+
+def get_cross_encoder() -> Optional[CrossEncoder]:
+    """
+    The cross-encoder, or None while it is still loading (or failed to load).
+    The first call starts loading it in the background.
+    """
+    global _model_future
+    with _model_lock:
+        if _model_future is None:
+            _model_future = Future()
+            threading.Thread(target=_load_model, args=(_model_future,), name="rerank-load", daemon=True).start()
+    if not _model_future.done() or _model_future.exception() is not None:
+        return None
+    return _model_future.result()
+
+def _load_model(future: Future):
+    try:
+        future.set_result(CrossEncoder(RERANK_MODEL))
+    except Exception as e:
+        future.set_exception(e)
+
+def _score_pairs(model: CrossEncoder, query: str, chunks: List[dict]) -> List[float]:
+    try:
+        # All pairs in a single forward pass
+        return model.predict([(query, c["text"]) for c in chunks], batch_size=len(chunks)).tolist()
+    finally:
+        _rerank_slots.release()
+
+def rerank(query: str, chunks: List[dict], top_k: int, budget_ms: int) -> List[dict]:
+    """
+    Reorder chunks by cross-encoder score and keep top_k. The first-stage order
+    is kept right away while the model is loading or every reranker worker is
+    busy, when scoring fails, and when it takes longer than budget_ms (the call then finishes
+    in the background, holding its worker, so later requests skip it).
+    """
+    if len(chunks) <= 1:
+        return chunks[:top_k]
+    model = get_cross_encoder()
+    if model is None or not _rerank_slots.acquire(blocking=False):
+        return chunks[:top_k]
+    future = _rerank_executor.submit(_score_pairs, model, query, chunks)
+    try:
+        scores = future.result(timeout=budget_ms / 1000.0)
+    except TimeoutError:
+        return chunks[:top_k]
+    except Exception:
+        # A failed scoring call (model error, out of memory) degrades to first-stage order
+        logger.exception("Cross-encoder reranking failed")
+        return chunks[:top_k]
+    reranked = [dict(c, rerank_score=s) for c, s in zip(chunks, scores)]
+    reranked.sort(key=lambda c: c["rerank_score"], reverse=True)
+    return reranked[:top_k]
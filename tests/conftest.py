@@ -0,0 +1,19 @@
+"""
+Point the app at a throwaway database and cache files before main is imported.
+"""
+
+import os
+import tempfile
+
+TEST_DIR = tempfile.mkdtemp(prefix="qna-tests-")
+
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(TEST_DIR, 'test.db')}"
+os.environ["DB_AUTO_MIGRATE"] = "1"
+os.environ["INGEST_RESUME"] = "0"
+os.environ["VECTOR_INDEX_DIR"] = os.path.join(TEST_DIR, "vector_indexes")
+os.environ["EMBEDDING_CACHE_FILE"] = os.path.join(TEST_DIR, "embedding_cache.db")
+os.environ["WIKI_CACHE_FILE"] = os.path.join(TEST_DIR, "wiki_cache.db")
+
+# main refuses to start without a frontend build; the tests never serve it, so an empty one will do
+os.environ["FRONTEND_DIST_DIR"] = os.path.join(TEST_DIR, "frontend")
+os.makedirs(os.path.join(TEST_DIR, "frontend", "assets"))
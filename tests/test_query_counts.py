@@ -0,0 +1,108 @@
+"""
+The reference endpoints run a fixed number of SQL statements, however many
+documents they return (no N+1 queries per document).
+"""
+
+import asyncio
+import itertools
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import event
+
+import main
+from models import SessionLocal, AsyncSessionLocal, engine, async_engine, User, Document, ExtractedText, Question, QuestionSource
+
+PAGES_PER_DOCUMENT = 5
+_user_numbers = itertools.count()
+
+
+@contextmanager
+def count_statements(db_engine):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db_engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db_engine, "before_cursor_execute", before_cursor_execute)
+
+
+@pytest.fixture
+def seed():
+    """
+    A function creating a user with n documents named "story <i>" (each with
+    a few pages mentioning "dragon") and a question sourced from all of them.
+    """
+    def make(n: int):
+        db = SessionLocal()
+        try:
+            user = User(email=f"user{next(_user_numbers)}@example.com", verified=True)
+            db.add(user)
+            db.flush()
+            question = Question(question_text="q", answer_text="a", user_id=user.id)
+            db.add(question)
+            for i in range(n):
+                doc = Document(name=f"story {i}", type="pdf", status="processed", user_id=user.id)
+                db.add(doc)
+                db.flush()
+                db.add_all([
+                    ExtractedText(document_id=doc.id, content=f"page {p} of story {i}: a dragon", page_number=p)
+                    for p in range(1, PAGES_PER_DOCUMENT + 1)
+                ])
+                db.add(QuestionSource(question_id=question.id, document_id=doc.id, relevance_score=1.0))
+            db.commit()
+            return SimpleNamespace(id=user.id), question.id
+        finally:
+            db.close()
+
+    return make
+
+
+@pytest.mark.parametrize("n", [1, 25])
+def test_get_references_query_count(seed, n):
+    user, question_id = seed(n)
+    db = SessionLocal()
+    try:
+        with count_statements(engine) as statements:
+            result = main.get_references(question_id, current_user=user, db=db)
+    finally:
+        db.close()
+    assert len(result["references"]) == n
+    assert all(len(r["snippets"]) == 3 for r in result["references"])
+    assert len(statements) == 3  # question, documents, snippets
+
+
+@pytest.mark.parametrize("n", [1, 25])
+def test_get_stories_by_source_query_count(seed, n):
+    user, _ = seed(n)
+    db = SessionLocal()
+    try:
+        with count_statements(engine) as statements:
+            result = main.get_stories_by_source("story", current_user=user, db=db)
+    finally:
+        db.close()
+    assert len(result["stories"]) == n
+    assert len(statements) == 2  # documents, snippets
+
+
+@pytest.mark.parametrize("n", [1, 25])
+def test_search_documents_like_query_count(seed, n):
+    user, _ = seed(n)
+
+    async def search():
+        try:
+            async with AsyncSessionLocal() as db:
+                return await main.search_documents_like("dragon", 100, 0, user, db)
+        finally:
+            await async_engine.dispose()  # its connections belong to this event loop
+
+    with count_statements(async_engine.sync_engine) as statements:
+        results = asyncio.run(search())
+    assert len(results) == n
+    assert all("dragon" in r["snippet"] for r in results)
+    assert len(statements) == 2  # documents, snippets
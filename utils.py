@@ -1,25 +1,130 @@
 import os
 import re
+import codecs
+import hashlib
+import threading
 import fitz  # PyMuPDF for PDF extraction
+import cv2
+import numpy as np
 from PIL import Image
 import pytesseract
-from fastapi import UploadFile
+from fastapi import UploadFile, HTTPException
+from contextlib import contextmanager
 from uuid import uuid4
+from typing import List, Tuple
+try:
+    import fcntl
+except ImportError:  # Windows: the thread lock alone only covers one worker process
+    fcntl = None
 
 # Directory to save uploaded files
 UPLOAD_FOLDER = "/tmp/uploaded_files"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# Uploads are streamed to disk in chunks of this size and rejected past the limit
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "100")) * 1024 * 1024
+
+# OCR settings: pages with less embedded text than OCR_MIN_TEXT_CHARS are
+# rasterized at OCR_DPI and OCRed; results are cached by image content hash
+OCR_CACHE_FOLDER = os.getenv("OCR_CACHE_DIR", "/tmp/ocr_cache")
+OCR_DPI = int(os.getenv("OCR_DPI", "200"))
+OCR_MAX_SIDE = int(os.getenv("OCR_MAX_SIDE", "3000"))  # downscale larger images (pixels)
+OCR_BINARIZE = os.getenv("OCR_BINARIZE", "1") == "1"
+OCR_MIN_TEXT_CHARS = int(os.getenv("OCR_MIN_TEXT_CHARS", "20"))
+os.makedirs(OCR_CACHE_FOLDER, exist_ok=True)
+
+# --- Stream an upload in chunks, enforcing the size limit ---
+def iter_upload_chunks(file: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES):
+    size = 0
+    while True:
+        chunk = file.file.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_bytes:
+            raise HTTPException(status_code=413, detail=f"File exceeds the {max_bytes // (1024 * 1024)} MB upload limit.")
+        yield chunk
+
 # --- Save any uploaded file (PDF/image/text) ---
-def save_upload_file(file: UploadFile) -> str:
+def save_upload_file(file: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES) -> Tuple[str, str, int]:
+    """
+    Stream an upload to disk. Returns (file_path, sha256 hex digest, size in bytes).
+    """
     ext = os.path.splitext(file.filename)[-1]
     unique_name = f"{uuid4().hex}{ext}"
     file_path = os.path.join(UPLOAD_FOLDER, unique_name)
-    
-    with open(file_path, "wb") as f:
-        f.write(file.file.read())
-    
-    return file_path
+
+    sha256 = hashlib.sha256()
+    size = 0
+    try:
+        with open(file_path, "wb") as f:
+            for chunk in iter_upload_chunks(file, max_bytes):
+                sha256.update(chunk)
+                size += len(chunk)
+                f.write(chunk)
+    except Exception:
+        os.remove(file_path)
+        raise
+
+    return file_path, sha256.hexdigest(), size
+
+# --- Content-addressed storage ---
+_blob_thread_lock = threading.Lock()
+
+@contextmanager
+def blob_lock():
+    """
+    Serializes placing and removing blobs across threads and worker processes.
+    Deletes check whether a blob is still referenced and remove it under this
+    lock, so an upload of the same content can't slip in between.
+    """
+    with _blob_thread_lock:
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(UPLOAD_FOLDER, ".blobs.lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def blob_path(file_path: str, content_hash: str) -> str:
+    """
+    Where store_blob() puts an upload: <UPLOAD_FOLDER>/<sha256><ext>.
+    """
+    ext = os.path.splitext(file_path)[-1].lower()
+    return os.path.join(UPLOAD_FOLDER, f"{content_hash}{ext}")
+
+def store_blob(file_path: str, content_hash: str) -> str:
+    """
+    Move a saved upload to its blob_path(). Identical uploads end up as one file
+    on disk, shared by every Document with that content_hash. Call it after the
+    Document referencing the blob is committed: a delete then either sees that
+    reference, or removes the old file before this puts it back.
+    """
+    path = blob_path(file_path, content_hash)
+    with blob_lock():
+        # Replacing (instead of skipping) keeps the blob present even if a delete removed it first
+        os.replace(file_path, path)
+    return path
+
+# --- Read an uploaded text file ---
+def read_upload_text(file: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES) -> Tuple[str, str, int]:
+    """
+    Decode an uploaded UTF-8 file chunk by chunk. Returns (text, sha256 hex digest, size in bytes).
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    sha256 = hashlib.sha256()
+    parts = []
+    size = 0
+    for chunk in iter_upload_chunks(file, max_bytes):
+        sha256.update(chunk)
+        size += len(chunk)
+        parts.append(decoder.decode(chunk))
+    parts.append(decoder.decode(b"", final=True))
+    return "".join(parts), sha256.hexdigest(), size
 
 # --- Clean extracted text ---
 
@@ -32,16 +137,67 @@ def clean_text(text: str) -> str:
     text = re.sub(r"[^A-Za-z0-9\s.,!?;:()\-]", "", text)
     return text.strip()
 
+# --- OCR ---
+def preprocess_for_ocr(image: Image.Image) -> Image.Image:
+    """
+    Grayscale, downscale to OCR_MAX_SIDE and (optionally) Otsu-binarize an image.
+    """
+    gray = np.array(image.convert("L"))
+    height, width = gray.shape
+    scale = OCR_MAX_SIDE / max(height, width)
+    if scale < 1:
+        gray = cv2.resize(gray, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+    if OCR_BINARIZE:
+        _, gray = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return Image.fromarray(gray)
+
+def ocr_image(image: Image.Image, content: bytes) -> str:
+    """
+    OCR an image, reusing the cached result for identical content (and OCR settings).
+    """
+    key = hashlib.sha256(content + f"|{OCR_MAX_SIDE}|{OCR_BINARIZE}".encode()).hexdigest()
+    cache_path = os.path.join(OCR_CACHE_FOLDER, f"{key}.txt")
+    if os.path.exists(cache_path):
+        with open(cache_path, "r", encoding="utf-8") as f:
+            return f.read()
+    text = clean_text(pytesseract.image_to_string(preprocess_for_ocr(image)))
+    with open(cache_path + ".tmp", "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(cache_path + ".tmp", cache_path)
+    return text
+
+def ocr_pdf_page(page: "fitz.Page") -> str:
+    pix = page.get_pixmap(dpi=OCR_DPI, colorspace=fitz.csGRAY)
+    image = Image.frombytes("L", (pix.width, pix.height), pix.samples)
+    return ocr_image(image, pix.samples)
+
 # --- Extract text from PDF ---
+def pdf_page_count(pdf_path: str) -> int:
+    with fitz.open(pdf_path) as doc:
+        return doc.page_count
+
+def extract_pdf_pages(pdf_path: str, start: int = 0, end: int = None) -> List[str]:
+    """
+    Return the cleaned text of pages [start, end), one string per page. Pages
+    without a usable text layer (scans) are OCRed. Runs standalone so page
+    ranges of one PDF can go to different processes.
+    """
+    pages = []
+    with fitz.open(pdf_path) as doc:
+        end = doc.page_count if end is None else min(end, doc.page_count)
+        for i in range(start, end):
+            text = clean_text(doc[i].get_text())
+            if len(text) < OCR_MIN_TEXT_CHARS:
+                text = ocr_pdf_page(doc[i]) or text
+            pages.append(text)
+    return pages
+
 def extract_text_from_pdf(pdf_path: str) -> str:
-    doc = fitz.open(pdf_path)
-    text = ""
-    for page in doc:
-        text += page.get_text()
-    return clean_text(text)
+    return " ".join(page for page in extract_pdf_pages(pdf_path) if page)
 
 # --- Extract text from image using OCR ---
 def extract_text_from_image(image_path: str) -> str:
+    with open(image_path, "rb") as f:
+        content = f.read()
     image = Image.open(image_path)
-    text = pytesseract.image_to_string(image)
-    return clean_text(text)
+    return ocr_image(image, content)